@@ -69,6 +69,20 @@ def get_spectrogram(waveform):
     spectrogram = spectrogram[..., tf.newaxis]
     return spectrogram
 
+def get_spectrograms(waveforms):
+    """
+    waveforms: 2D tensor of ECG recordings, one recording per row
+    
+    returns: spectrograms of all recordings, computed as in get_spectrogram with one batched STFT
+    """
+    input_len = get_input_length()
+    waveforms = tf.cast(waveforms[:, :input_len], dtype=tf.float32)
+    equal_length = tf.pad(waveforms, [[0, 0], [0, input_len - tf.shape(waveforms)[1]]])
+    spectrograms = tf.signal.stft(
+      equal_length, frame_length=255, frame_step=128)
+    spectrograms = tf.abs(spectrograms)
+    return spectrograms[..., tf.newaxis]
+
 def get_spectrogram_and_label_id(audio, label):
     commands = ['0' '1']
     spectrogram = get_spectrogram(audio)
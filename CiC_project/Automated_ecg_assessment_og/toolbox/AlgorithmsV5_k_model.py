@@ -1,3 +1,4 @@
+import functools
 import numpy as np
 import scipy.signal
 from ecgdetectors import Detectors
@@ -5,69 +6,151 @@ import scipy.stats
 import neurokit2 as nk
 import time
 import tensorflow as tf
-from cnn_lstm.utils.data_preprocessing_utils import preprocess_dataset_toolbox, normalizer_minus_one_to_one
+from cnn_lstm.utils.data_preprocessing_utils import get_spectrogram, get_spectrograms, get_input_length
+
+# CNN-LSTM models and their compiled predict functions, loaded once per process
+_model_cache = {}
+
+@functools.lru_cache(maxsize=None)
+def _buttord_coefficients(wp, ws, gpass, gstop, fs):
+    """
+    Memoised lowest order Butterworth low pass filter with at most gpass dB loss at wp and at
+    least gstop dB attenuation at ws, as (b, a). The arrays are shared by all calls and read-only.
+    """
+    order, normal_cutoff = scipy.signal.buttord(wp, ws, gpass, gstop, fs=fs)
+    b, a = scipy.signal.butter(order, normal_cutoff, fs=fs)
+    b.flags.writeable = False
+    a.flags.writeable = False
+    return b, a
 
 def high_frequency_noise_filter(data, max_loss_passband, min_loss_stopband, sampling_frequency=500):
-    order, normal_cutoff = scipy.signal.buttord(20, 30, max_loss_passband, 
-                                                min_loss_stopband, fs=sampling_frequency)
-    iir_b, iir_a = scipy.signal.butter(order, normal_cutoff, fs=sampling_frequency)
+    iir_b, iir_a = _buttord_coefficients(20, 30, max_loss_passband, min_loss_stopband, sampling_frequency)
     filtered_data = scipy.signal.filtfilt(iir_b, iir_a, data)
     return filtered_data
 
 def baseline_filter(data, max_loss_passband, min_loss_stopband, sampling_frequency=500):
-    order, normal_cutoff = scipy.signal.buttord(0.5, 8, max_loss_passband, 
-                                                min_loss_stopband, fs=sampling_frequency)
-    iir_b, iir_a = scipy.signal.butter(order, normal_cutoff, fs=sampling_frequency)
+    iir_b, iir_a = _buttord_coefficients(0.5, 8, max_loss_passband, min_loss_stopband, sampling_frequency)
     filtered_data = scipy.signal.filtfilt(iir_b, iir_a, data)
     return filtered_data
 
+def stationary_leads(leads, window_length, stride=10):
+    """
+    Returns a boolean array with one value per lead (row of leads), True if a
+    window of window_length samples starting at a multiple of stride is constant.
+    A window is constant if it lies in one run of equal samples, i.e. if the run
+    containing its last sample starts at or before the window start.
+    """
+    leads = np.asarray(leads)
+    n_samples = leads.shape[-1]
+    window_starts = np.arange(0, n_samples - window_length + 1, stride)
+    if len(window_starts) == 0:
+        return np.zeros(leads.shape[:-1], dtype=bool)
+    run_start = np.zeros(leads.shape, dtype=np.intp)
+    run_start[..., 1:] = np.where(leads[..., 1:] != leads[..., :-1], np.arange(1, n_samples), 0)
+    run_start = np.maximum.accumulate(run_start, axis=-1)
+    return np.any(run_start[..., window_starts + window_length - 1] <= window_starts, axis=-1)
+
 def stationary_signal_check(data, num_leads, window_length):
-    result = [0]*num_leads
-    for lead_nr in range(1, num_leads + 1):
-        window_matrix = np.lib.stride_tricks.sliding_window_view(data[num_leads], window_length)[::10]
-        for window in window_matrix:
-            if np.amax(window) == np.amin(window):
-                result[lead_nr-1] = 1
-                break
-    return result
+    # row 0 holds the sample index
+    return stationary_leads(np.asarray(data)[1:num_leads + 1], window_length).astype(int).tolist()
+
+def pan_tompkins_beats(detectors, leads):
+    """
+    Returns the Pan Tompkins beats of every lead (row of leads). All leads go to the detector in
+    one call if it takes (channels, samples) arrays (Detectors.multichannel, the toolbox copy of
+    ecgdetectors), otherwise, e.g. with the pip py-ecg-detectors, one lead per call.
+    """
+    if getattr(detectors, 'multichannel', False):
+        return detectors.pan_tompkins_detector(np.asarray(leads))
+    return [detectors.pan_tompkins_detector(lead) for lead in leads]
 
 def heart_rate_check(data, num_leads, heart_rate_limits, sampling_frequency, length_recording=10):
-    result = [0]*num_leads
-    for lead_nr in range(1, num_leads + 1):
-        beats = Detectors(sampling_frequency).pan_tompkins_detector(data[lead_nr])
-        if (len(beats) > ((heart_rate_limits[1]*length_recording)/60)) or \
-           (len(beats) < ((heart_rate_limits[0]*length_recording)/60)):
-            result[lead_nr-1] = 1
-    return result
+    # row 0 holds the sample index
+    beats = pan_tompkins_beats(Detectors(sampling_frequency), np.asarray(data)[1:num_leads + 1])
+    n_beats = np.array([len(lead_beats) for lead_beats in beats])
+    result = (n_beats > ((heart_rate_limits[1]*length_recording)/60)) | \
+             (n_beats < ((heart_rate_limits[0]*length_recording)/60))
+    return result.astype(int).tolist()
+
+@functools.lru_cache(maxsize=None)
+def _band_power_weights(n_samples, fs, band):
+    """
+    Weights of the rfft bins of n_samples at fs: column 0 gives the total and
+    column 1 the in-band (band[0] <= f < band[1]) power of the one-sided
+    periodogram, which counts the bins that stand for two frequencies twice.
+    """
+    bins = np.arange(n_samples//2 + 1)
+    weights = np.full(len(bins), 2.0)
+    weights[0] = 1
+    if n_samples % 2 == 0:
+        weights[-1] = 1
+    # f = bins*fs/n_samples, compared without dividing
+    in_band = (bins*fs >= band[0]*n_samples) & (bins*fs < band[1]*n_samples)
+    weights = np.stack((weights, weights*in_band), axis=1)
+    weights.flags.writeable = False
+    return weights
+
+def signal_to_noise_ratio(leads, fs, band):
+    """
+    Returns the ratio of the power in band to the power outside of it for every
+    lead (row of leads), NaN for leads without power, from one rfft over all leads.
+    """
+    leads = np.asarray(leads, dtype=float)
+    # constant detrend as in scipy.signal.periodogram
+    power = np.abs(np.fft.rfft(leads - leads.mean(axis=-1, keepdims=True), axis=-1))**2
+    total_power, signal_power = np.moveaxis(power @ _band_power_weights(leads.shape[-1], fs, tuple(band)), -1, 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return signal_power / (total_power - signal_power)
 
 def signal_to_noise_ratio_check(data, num_leads, SNR_threshold, signal_freq_band, sampling_frequency=500):
-    result = [0]*num_leads
-    for lead_nr in range(1, num_leads + 1):
-        f, power_spectral_density = scipy.signal.periodogram(data[lead_nr], fs=sampling_frequency, scaling="spectrum")
-        if sum(power_spectral_density):
-            signal_power = sum(power_spectral_density[(signal_freq_band[0]*10):(signal_freq_band[1]*10)])
-            SNR = signal_power / (sum(power_spectral_density) - signal_power)
-            if SNR < SNR_threshold:
-                result[lead_nr-1] = 1
-    return result
+    # leads without power pass, NaN < SNR_threshold is False
+    SNR = signal_to_noise_ratio(np.asarray(data)[1:num_leads + 1], sampling_frequency, signal_freq_band)
+    return (SNR < SNR_threshold).astype(int).tolist()
 
-def CNN_quality_check(data, num_leads, path_model, name_model, sampling_frequency=500):
-    ecg_data_list = []
+def load_cnn_model(path_model, name_model):
+    """
+    Returns the CNN-LSTM model and a predict function returning the softmax probabilities
+    of a batch of spectrograms. Both are created and warmed up on first use and cached by path and name.
+    """
+    key = (path_model, name_model)
+    if key not in _model_cache:
+        model = tf.keras.models.load_model(path_model+'/'+name_model)
+        spectrogram_shape = get_spectrogram(tf.zeros([get_input_length()])).shape
+
+        # compiled once for the fixed spectrogram shape, only the batch size may vary
+        @tf.function(input_signature=[tf.TensorSpec([None, *spectrogram_shape], tf.float32)])
+        def predict(spectrograms):
+            return tf.nn.softmax(model(spectrograms, training=False), axis=-1)
+
+        # warm-up, traces the graph before the first real call
+        predict(tf.zeros([1, *spectrogram_shape]))
+        _model_cache[key] = (model, predict)
+    return _model_cache[key]
+
+def CNN_probabilities(data, path_model, name_model, batch_size=256):
+    """
+    data: array of shape (n_recordings, datapoints), e.g. the leads of many signals stacked
     
-    for lead_nr in range(1, num_leads + 1):
-        ecg_data = normalizer_minus_one_to_one(data[lead_nr]) # normalize data -1 to 1
-        ecg_data_list.append(np.asarray(ecg_data, dtype=np.float32))
-        
-    ecg_data_list = tf.constant(ecg_data_list)
-    sample_ds = preprocess_dataset_toolbox(ecg_data_list)
-    model = tf.keras.models.load_model(path_model+'/'+name_model)
-    result = [0]*num_leads
+    returns: softmax probabilities of shape (n_recordings, 2), the first column is the probability of bad quality
+    """
+    data = np.asarray(data, dtype=np.float64)
+    # normalize each recording -1 to 1 as in normalizer_minus_one_to_one, constant recordings become 0
+    max_val = data.max(axis=1, keepdims=True)
+    min_val = data.min(axis=1, keepdims=True)
+    data_range = np.where(max_val == min_val, 1, max_val - min_val)
+    ecg_data = np.where(max_val == min_val, 0, 2 * ((data - min_val) / data_range) - 1).astype(np.float32)
     
-    for lead_nr, (spectrogram) in enumerate(sample_ds.batch(1)):
-        prediction = model(spectrogram)
-        probability_0, probability_1 = np.array(tf.nn.softmax(prediction[0]))
-        if probability_0 > 0.5: 
-            result[lead_nr] = 1
+    model, predict = load_cnn_model(path_model, name_model)
+    probabilities = np.zeros((len(ecg_data), 2), dtype=np.float32)
+    for start in range(0, len(ecg_data), batch_size):
+        spectrograms = get_spectrograms(tf.constant(ecg_data[start:start + batch_size]))
+        probabilities[start:start + batch_size] = predict(spectrograms).numpy()
+            
+    return probabilities
+
+def CNN_quality_check(data, num_leads, path_model, name_model, sampling_frequency=500):
+    probabilities = CNN_probabilities([data[lead_nr] for lead_nr in range(1, num_leads + 1)], path_model, name_model)
+    result = [1 if probability_0 > 0.5 else 0 for probability_0 in probabilities[:, 0]]
             
     return result
     
@@ -8,6 +8,8 @@ Copyright (C) 2019-2022 Luis Howell & Bernd Porr
 GPL GNU GENERAL PUBLIC LICENSE Version 3, 29 June 2007
 """
 
+import collections
+import functools
 import numpy as np
 # import pywt
 try:
@@ -22,9 +24,15 @@ class Detectors:
     General useage instructions:
     r_peaks = detectors.the_detector(ecg_in_samples)
     The argument ecg_in_samples is a single channel ECG in volt
-    at the given sample rate.
+    at the given sample rate. It can also be a 2D array with one
+    channel per row (e.g. the leads of a recording or records of
+    equal length): the filters then run over all channels at once
+    and a list with the r-peaks of every channel is returned.
     """
 
+    ## The detectors take (channels, samples) arrays, unlike the pip py-ecg-detectors
+    multichannel = True
+
     def __init__(self, sampling_frequency):
         """
         The constructor takes the sampling rate in Hz of the ECG data.
@@ -57,77 +65,26 @@ class Detectors:
         f1 = 8/self.fs
         f2 = 16/self.fs
 
-        b, a = signal.butter(1, [f1*2, f2*2], btype='bandpass')
+        b, a = _butter_coefficients(1, (f1*2, f2*2), 'bandpass')
 
-        filtered_ecg = signal.lfilter(b, a, unfiltered_ecg)
+        filtered_ecg = signal.lfilter(b, a, unfiltered_ecg, axis=-1)
 
-        diff = abs(np.diff(filtered_ecg))
+        diff = abs(np.diff(filtered_ecg, axis=-1))
 
         b = np.ones(int(0.08*self.fs))
         b = b/int(0.08*self.fs)
         a = [1]
 
-        ma = signal.lfilter(b, a, diff)
-
-        ma[0:len(b)*2] = 0
-
-        n_pks = []
-        n_pks_ave = 0.0
-        s_pks = []
-        s_pks_ave = 0.0
-        QRS = [0]
-        RR = []
-        RR_ave = 0.0
-
-        th = 0.0
-
-        i=0
-        idx = []
-        peaks = []  
-
-        for i in range(len(ma)):
-
-            if i>0 and i<len(ma)-1:
-                if ma[i-1]<ma[i] and ma[i+1]<ma[i]:
-                    peak = i
-                    peaks.append(i)
-
-                    if ma[peak] > th and (peak-QRS[-1])>0.3*self.fs:        
-                        QRS.append(peak)
-                        idx.append(i)
-                        s_pks.append(ma[peak])
-                        if len(n_pks)>8:
-                            s_pks.pop(0)
-                        s_pks_ave = np.mean(s_pks)
-
-                        if RR_ave != 0.0:
-                            if QRS[-1]-QRS[-2] > 1.5*RR_ave:
-                                missed_peaks = peaks[idx[-2]+1:idx[-1]]
-                                for missed_peak in missed_peaks:
-                                    if missed_peak-peaks[idx[-2]]>int(0.360*self.fs) and ma[missed_peak]>0.5*th:
-                                        QRS.append(missed_peak)
-                                        QRS.sort()
-                                        break
-
-                        if len(QRS)>2:
-                            RR.append(QRS[-1]-QRS[-2])
-                            if len(RR)>8:
-                                RR.pop(0)
-                            RR_ave = int(np.mean(RR))
-
-                    else:
-                        n_pks.append(ma[peak])
-                        if len(n_pks)>8:
-                            n_pks.pop(0)
-                        n_pks_ave = np.mean(n_pks)
+        ma = signal.lfilter(b, a, diff, axis=-1)
 
-                    th = n_pks_ave + 0.45*(s_pks_ave-n_pks_ave)
+        ma[..., 0:len(b)*2] = 0
 
-                    i+=1
+        def threshold(ma):
+            peaks = (np.flatnonzero((ma[1:-1] > ma[:-2]) & (ma[1:-1] > ma[2:])) + 1).tolist()
+            # missed beats are inserted in order as in QRS.sort()
+            return sorted(_HamiltonThreshold(self.fs).process(peaks, ma[peaks].tolist()))
 
-        QRS.pop(0)
-
-        return QRS
+        return _for_each_channel(threshold, ma)
 
     
     def christov_detector(self, unfiltered_ecg):
@@ -136,128 +93,28 @@ class Detectors:
         Real time electrocardiogram QRS detection using combined 
         adaptive threshold, BioMedical Engineering OnLine 2004, 
         vol. 3:28, 2004.
+        For a live feed see ChristovStream.
         """
-        total_taps = 0
-
-        b = np.ones(int(0.02*self.fs))
-        b = b/int(0.02*self.fs)
-        total_taps += len(b)
-        a = [1]
-
-        MA1 = signal.lfilter(b, a, unfiltered_ecg)
+        averages = _christov_averages(self.fs)
+        total_taps = sum(len(b) for b in averages)
 
-        b = np.ones(int(0.028*self.fs))
-        b = b/int(0.028*self.fs)
-        total_taps += len(b)
-        a = [1]
+        MA1 = signal.lfilter(averages[0], [1], unfiltered_ecg, axis=-1)
 
-        MA2 = signal.lfilter(b, a, MA1)
-
-        Y = []
-        for i in range(1, len(MA2)-1):
-            
-            diff = abs(MA2[i+1]-MA2[i-1])
-
-            Y.append(diff)
-
-        b = np.ones(int(0.040*self.fs))
-        b = b/int(0.040*self.fs)
-        total_taps += len(b)
-        a = [1]
+        MA2 = signal.lfilter(averages[1], [1], MA1, axis=-1)
 
-        MA3 = signal.lfilter(b, a, Y)
+        Y = abs(MA2[..., 2:]-MA2[..., :-2])
 
-        MA3[0:total_taps] = 0
+        MA3 = signal.lfilter(averages[2], [1], Y, axis=-1)
 
-        ms50 = int(0.05*self.fs)
-        ms200 = int(0.2*self.fs)
-        ms1200 = int(1.2*self.fs)
-        ms350 = int(0.35*self.fs)
+        MA3[..., 0:total_taps] = 0
 
-        M = 0
-        newM5 = 0
-        M_list = []
-        MM = []
-        M_slope = np.linspace(1.0, 0.6, ms1200-ms200)
-        F = 0
-        F_list = []
-        R = 0
-        RR = []
-        Rm = 0
-        R_list = []
-
-        MFR = 0
-        MFR_list = []
-
-        QRS = []
-
-        for i in range(len(MA3)):
-
-            # M
-            if i < 5*self.fs:
-                M = 0.6*np.max(MA3[:i+1])
-                MM.append(M)
-                if len(MM)>5:
-                    MM.pop(0)
-
-            elif QRS and i < QRS[-1]+ms200:
-                newM5 = 0.6*np.max(MA3[QRS[-1]:i])
-                if newM5>1.5*MM[-1]:
-                    newM5 = 1.1*MM[-1]
-
-            elif QRS and i == QRS[-1]+ms200:
-                if newM5==0:
-                    newM5 = MM[-1]
-                MM.append(newM5)
-                if len(MM)>5:
-                    MM.pop(0)    
-                M = np.mean(MM)    
-            
-            elif QRS and i > QRS[-1]+ms200 and i < QRS[-1]+ms1200:
+        def threshold(MA3):
+            QRS = _ChristovThreshold(self.fs).process(MA3)
+            QRS.pop(0)
+            return QRS
 
-                M = np.mean(MM)*M_slope[i-(QRS[-1]+ms200)]
-
-            elif QRS and i > QRS[-1]+ms1200:
-                M = 0.6*np.mean(MM)
-
-            # F
-            if i > ms350:
-                F_section = MA3[i-ms350:i]
-                max_latest = np.max(F_section[-ms50:])
-                max_earliest = np.max(F_section[:ms50])
-                F = F + ((max_latest-max_earliest)/150.0)
-
-            # R
-            if QRS and i < QRS[-1]+int((2.0/3.0*Rm)):
-
-                R = 0
-
-            elif QRS and i > QRS[-1]+int((2.0/3.0*Rm)) and i < QRS[-1]+Rm:
-
-                dec = (M-np.mean(MM))/1.4
-                R = 0 + dec
-
-
-            MFR = M+F+R
-            M_list.append(M)
-            F_list.append(F)
-            R_list.append(R)
-            MFR_list.append(MFR)
-
-            if not QRS and MA3[i]>MFR:
-                QRS.append(i)
-            
-            elif QRS and i > QRS[-1]+ms200 and MA3[i]>MFR:
-                QRS.append(i)
-                if len(QRS)>2:
-                    RR.append(QRS[-1]-QRS[-2])
-                    if len(RR)>5:
-                        RR.pop(0)
-                    Rm = int(np.mean(RR))
-
-        QRS.pop(0)
-        
-        return QRS
+        # without any detection there is no 1st QRS to pop
+        return _for_each_channel(threshold, MA3, empty=(IndexError,))
 
     
     def engzee_detector(self, unfiltered_ecg):
@@ -268,117 +125,25 @@ class Detectors:
         P. Leite, R. Lourenco and A. Fred, “Real Time
         Electrocardiogram Segmentation for Finger Based ECG
         Biometrics”, BIOSIGNALS 2012, pp. 49-54, 2012.
+        For a live feed see EngzeeStream.
         """
-                
-        f1 = 48/self.fs
-        f2 = 52/self.fs
-        b, a = signal.butter(4, [f1*2, f2*2], btype='bandstop')
-        filtered_ecg = signal.lfilter(b, a, unfiltered_ecg)
-
-        diff = np.zeros(len(filtered_ecg))
-        for i in range(4, len(diff)):
-            diff[i] = filtered_ecg[i]-filtered_ecg[i-4]
+        (b, a), ci = _engzee_filters(self.fs)
+        filtered_ecg = signal.lfilter(b, a, unfiltered_ecg, axis=-1)
 
-        ci = [1,4,6,4,1]        
-        low_pass = signal.lfilter(ci, 1, diff)
+        diff = np.zeros(filtered_ecg.shape)
+        diff[..., 4:] = filtered_ecg[..., 4:]-filtered_ecg[..., :-4]
 
-        low_pass[:int(0.2*self.fs)] = 0
-      
-        ms200 = int(0.2*self.fs)
-        ms1200 = int(1.2*self.fs)        
-        ms160 = int(0.16*self.fs)
-        neg_threshold = int(0.01*self.fs)
+        low_pass = signal.lfilter(ci, 1, diff, axis=-1)
 
-        M = 0
-        M_list = []
-        neg_m = []
-        MM = []
-        M_slope = np.linspace(1.0, 0.6, ms1200-ms200)
+        low_pass[..., :int(0.2*self.fs)] = 0
 
-        QRS = []
-        r_peaks = []
-
-        counter = 0
-
-        thi_list = []
-        thi = False
-        thf_list = []
-        thf = False
-        newM5 = False
-
-        for i in range(len(low_pass)):
-
-            # M
-            if i < 5*self.fs:
-                M = 0.6*np.max(low_pass[:i+1])
-                MM.append(M)
-                if len(MM)>5:
-                    MM.pop(0)
-
-            elif QRS and i < QRS[-1]+ms200:
+        def threshold(low_pass, unfiltered_ecg):
+            r_peaks = _EngzeeThreshold(self.fs, self.engzee_fake_delay).process(low_pass, unfiltered_ecg)
+            # removing the 1st detection as it 1st needs the QRS complex amplitude for the threshold
+            r_peaks.pop(0)
+            return r_peaks
 
-                newM5 = 0.6*np.max(low_pass[QRS[-1]:i])
-
-                if newM5>1.5*MM[-1]:
-                    newM5 = 1.1*MM[-1]
-
-            elif newM5 and QRS and i == QRS[-1]+ms200:
-                MM.append(newM5)
-                if len(MM)>5:
-                    MM.pop(0)    
-                M = np.mean(MM)    
-            
-            elif QRS and i > QRS[-1]+ms200 and i < QRS[-1]+ms1200:
-
-                M = np.mean(MM)*M_slope[i-(QRS[-1]+ms200)]
-
-            elif QRS and i > QRS[-1]+ms1200:
-                M = 0.6*np.mean(MM)
-
-            M_list.append(M)
-            neg_m.append(-M)
-
-
-            if not QRS and low_pass[i]>M:
-                QRS.append(i)
-                thi_list.append(i)
-                thi = True
-            
-            elif QRS and i > QRS[-1]+ms200 and low_pass[i]>M:
-                QRS.append(i)
-                thi_list.append(i)
-                thi = True
-
-            if thi and i<thi_list[-1]+ms160:
-                if low_pass[i]<-M and low_pass[i-1]>-M:
-                    #thf_list.append(i)
-                    thf = True
-                    
-                if thf and low_pass[i]<-M:
-                    thf_list.append(i)
-                    counter += 1
-                
-                elif low_pass[i]>-M and thf:
-                    counter = 0
-                    thi = False
-                    thf = False
-            
-            elif thi and i>thi_list[-1]+ms160:
-                    counter = 0
-                    thi = False
-                    thf = False                                        
-            
-            if counter>neg_threshold:
-                unfiltered_section = unfiltered_ecg[thi_list[-1]-int(0.01*self.fs):i]
-                r_peaks.append(self.engzee_fake_delay+
-                               np.argmax(unfiltered_section)+thi_list[-1]-int(0.01*self.fs))
-                counter = 0
-                thi = False
-                thf = False
-
-        # removing the 1st detection as it 1st needs the QRS complex amplitude for the threshold
-        r_peaks.pop(0)
-        return r_peaks
+        return _for_each_channel(threshold, low_pass, np.asarray(unfiltered_ecg), empty=(IndexError,))
 
     
     def matched_filter_detector(self, unfiltered_ecg, template_file = ""):
@@ -406,19 +171,17 @@ class Detectors:
         f0 = 0.1/self.fs
         f1 = 48/self.fs
 
-        b, a = signal.butter(4, [f0*2, f1*2], btype='bandpass')
+        b, a = _butter_coefficients(4, (f0*2, f1*2), 'bandpass')
 
-        prefiltered_ecg = signal.lfilter(b, a, unfiltered_ecg)
+        prefiltered_ecg = signal.lfilter(b, a, unfiltered_ecg, axis=-1)
 
         matched_coeffs = template[::-1]  #time reversing template
 
-        detection = signal.lfilter(matched_coeffs, 1, prefiltered_ecg)  # matched filter FIR filtering
+        detection = signal.lfilter(matched_coeffs, 1, prefiltered_ecg, axis=-1)  # matched filter FIR filtering
         squared = detection*detection  # squaring matched filter output
-        squared[:len(template)] = 0
+        squared[..., :len(template)] = 0
 
-        squared_peaks = panPeakDetect(squared, self.fs)
-  
-        return squared_peaks
+        return _for_each_channel(lambda x: panPeakDetect(x, self.fs), squared)
 
     
     def swt_detector(self, unfiltered_ecg, MWA_name='cumulative'):
@@ -434,30 +197,23 @@ class Detectors:
         
         maxQRSduration = 0.150 #sec
         swt_level=3
-        padding = -1
-        for i in range(1000):
-            if (len(unfiltered_ecg)+i)%2**swt_level == 0:
-                padding = i
-                break
+        unfiltered_ecg = np.asarray(unfiltered_ecg, dtype=float)
 
+        padding, steps = _swt_plan(unfiltered_ecg.shape[-1], swt_level)
         if padding > 0:
-            unfiltered_ecg = np.pad(unfiltered_ecg, (0, padding), 'edge')
-        elif padding == -1:
-            print("Padding greater than 1000 required\n")    
+            pad_width = [(0, 0)]*(unfiltered_ecg.ndim-1) + [(0, padding)]
+            unfiltered_ecg = np.pad(unfiltered_ecg, pad_width, 'edge')
 
-        swt_ecg = pywt.swt(unfiltered_ecg, 'db3', level=swt_level)
-        swt_ecg = np.array(swt_ecg)
-        swt_ecg = swt_ecg[0, 1, :]
+        # detail coefficients of the last level, pywt.swt(unfiltered_ecg, 'db3', level=swt_level)[0][1]
+        swt_ecg = _swt_detail(unfiltered_ecg, steps)
 
         squared = swt_ecg*swt_ecg
 
         N = int(maxQRSduration*self.fs)
         mwa = MWA_from_name(MWA_name)(squared, N)
-        mwa[:int(maxQRSduration*self.fs*2)] = 0
+        mwa[..., :int(maxQRSduration*self.fs*2)] = 0
 
-        filt_peaks = panPeakDetect(mwa, self.fs)
-        
-        return filt_peaks
+        return _for_each_channel(lambda x: panPeakDetect(x, self.fs), mwa)
 
 
     def pan_tompkins_detector(self, unfiltered_ecg, MWA_name='cumulative'):
@@ -472,21 +228,19 @@ class Detectors:
         f1 = 5/self.fs
         f2 = 15/self.fs
 
-        b, a = signal.butter(1, [f1*2, f2*2], btype='bandpass')
+        b, a = _butter_coefficients(1, (f1*2, f2*2), 'bandpass')
 
-        filtered_ecg = signal.lfilter(b, a, unfiltered_ecg)        
+        filtered_ecg = signal.lfilter(b, a, unfiltered_ecg, axis=-1)
 
-        diff = np.diff(filtered_ecg) 
+        diff = np.diff(filtered_ecg, axis=-1)
 
         squared = diff*diff
 
         N = int(maxQRSduration*self.fs)
         mwa = MWA_from_name(MWA_name)(squared, N)
-        mwa[:int(maxQRSduration*self.fs*2)] = 0
-
-        mwa_peaks = panPeakDetect(mwa, self.fs)
+        mwa[..., :int(maxQRSduration*self.fs*2)] = 0
 
-        return mwa_peaks
+        return _for_each_channel(lambda x: panPeakDetect(x, self.fs), mwa)
 
 
     def two_average_detector(self, unfiltered_ecg, MWA_name='cumulative'):
@@ -501,9 +255,9 @@ class Detectors:
         f1 = 8/self.fs
         f2 = 20/self.fs
 
-        b, a = signal.butter(2, [f1*2, f2*2], btype='bandpass')
+        b, a = _butter_coefficients(2, (f1*2, f2*2), 'bandpass')
 
-        filtered_ecg = signal.lfilter(b, a, unfiltered_ecg)
+        filtered_ecg = signal.lfilter(b, a, unfiltered_ecg, axis=-1)
 
         window1 = int(0.12*self.fs)
         mwa_qrs = MWA_from_name(MWA_name)(abs(filtered_ecg), window1)
@@ -511,40 +265,49 @@ class Detectors:
         window2 = int(0.6*self.fs)
         mwa_beat = MWA_from_name(MWA_name)(abs(filtered_ecg), window2)
 
-        blocks = np.zeros(len(unfiltered_ecg))
+        blocks = mwa_qrs > mwa_beat
+
+        return _for_each_channel(self._two_average_threshold, filtered_ecg, blocks)
+
+    def _two_average_threshold(self, filtered_ecg, blocks):
         block_height = np.max(filtered_ecg)
 
-        for i in range(len(mwa_qrs)):
-            if mwa_qrs[i] > mwa_beat[i]:
-                blocks[i] = block_height
-            else:
-                blocks[i] = 0
+        # the blocks only have edges if their height differs from 0
+        if np.isnan(block_height) or block_height == 0:
+            return []
 
-        QRS = []
+        starts = np.flatnonzero(~blocks[:-1] & blocks[1:]) + 1
+        ends = np.flatnonzero(blocks[:-1] & ~blocks[1:])
+        if len(starts) == 0:
+            return []
 
-        for i in range(1, len(blocks)):
-            if blocks[i-1] == 0 and blocks[i] == block_height:
-                start = i
-            
-            elif blocks[i-1] == block_height and blocks[i] == 0:
-                end = i-1
+        # every block ends before the next one starts, a block still open at the end is dropped
+        ends = ends[ends >= starts[0]]
+        starts = starts[:len(ends)]
+        wide = ends-starts > int(0.08*self.fs)
 
-                if end-start>int(0.08*self.fs):
-                    detection = np.argmax(filtered_ecg[start:end+1])+start
-                    if QRS:
-                        if detection-QRS[-1]>int(0.3*self.fs):
-                            QRS.append(detection)
-                    else:
-                        QRS.append(detection)
+        QRS = []
+
+        for start, end in zip(starts[wide], ends[wide]):
+            detection = np.argmax(filtered_ecg[start:end+1])+start
+            if QRS:
+                if detection-QRS[-1]>int(0.3*self.fs):
+                    QRS.append(detection)
+            else:
+                QRS.append(detection)
 
         return QRS
 
-    def wqrs_detector(self, unfiltered_ecg):
+    def wqrs_detector(self, unfiltered_ecg, window_sum=False):
         """
         based on W Zong, GB Moody, D Jiang 
         A Robust Open-source Algorithm to Detect Onset and Duration of QRS
         Complexes 
         In: 2003 IEEE
+
+        window_sum=True sums the curve length over the window as in the paper,
+        instead of repeating the length of the last sample, which changes the
+        detections. The default keeps the output of the original detector.
         """
         def butter_lowpass_filter(data, cutoff):
             nyq = 0.5 * self.fs
@@ -552,32 +315,812 @@ class Detectors:
 
             normal_cutoff = cutoff / nyq
             
-            b, a = signal.butter(order, normal_cutoff, btype='low', analog=False)
-            y = signal.lfilter(b, a, data)
+            b, a = _butter_coefficients(order, normal_cutoff, 'low')
+            y = signal.lfilter(b, a, data, axis=-1)
             return y
 
-        def length_transfrom(x, w):
-            tmp = []
-            for i in range(w, len(x)):
-                curr = 0
-                for k in range(i-w+1, i):
-                    curr += np.sqrt(np.power(1/self.fs, 2)+np.power(x[i]-x[i-1],2))
-                tmp.append(curr)
-            l = [tmp[0]]*w
-            
-            return l+tmp
-        
         def threshold(x):
             peaks = []
             u = MWA_convolve(x, 10*self.fs)
-            for i in range(len(x)):
-                if (len(peaks) == 0 or i > peaks[-1]+(self.fs*0.35)) and x[i] > u[i]:
-                    peaks.append(i)
+            above = np.flatnonzero(x > u)
+            # next sample above the average after the 350 ms refractory period of the last peak
+            i = 0
+            while i < len(above):
+                peaks.append(int(above[i]))
+                i = np.searchsorted(above, peaks[-1]+(self.fs*0.35), side='right')
             return peaks
         
         y = butter_lowpass_filter(unfiltered_ecg, 15)
-        y = length_transfrom(y, int(np.ceil(self.fs*0.13)))
-        return threshold(y)
+        y = _wqrs_length_transform(y, int(np.ceil(self.fs*0.13)), self.fs, window_sum)
+        return _for_each_channel(threshold, y)
+
+
+def _wqrs_length_transform(x, w, fs, window_sum=False):
+    """
+    Length transform of the WQRS detector over windows of w samples, along the last axis.
+    See Detectors.wqrs_detector for window_sum.
+    """
+    if window_sum:
+        # curve length over the window: sum of sqrt(dt^2+dx^2) for k in i-w+1..i-1
+        lengths = np.sqrt(np.power(1/fs, 2)+np.power(np.diff(x, axis=-1), 2))
+        cumulative = np.cumsum(lengths, axis=-1)
+        cumulative = np.concatenate((np.zeros(cumulative.shape[:-1]+(1,)), cumulative), axis=-1)
+        tmp = cumulative[..., w-1:-1] - cumulative[..., :-w]
+        l = np.repeat(tmp[..., :1], w, axis=-1)
+        return np.concatenate((l, tmp), axis=-1)
+
+    # the loop this replaces added the term of sample i (not k) w-1 times, giving
+    # (w-1)*sqrt(dt^2+(x[i]-x[i-1])^2) for i >= w and the first value for the first w samples.
+    # The term is added w-1 times as before, over whole arrays: the product rounds differently
+    # in the last bit, and the threshold compares the constant first samples with their own
+    # average, so that moves the detections.
+    term = np.sqrt(np.power(1/fs, 2)+np.power(np.diff(x, axis=-1)[..., w-1:], 2))
+    tmp = np.zeros_like(term)
+    for _ in range(w-1):
+        tmp += term
+    l = np.repeat(tmp[..., :1], w, axis=-1)
+
+    return np.concatenate((l, tmp), axis=-1)
+
+
+## Daubechies 3 decomposition filters, pywt.Wavelet('db3').dec_lo and dec_hi
+_DB3_DEC_LO = np.array([0.03522629188570953, -0.08544127388202666, -0.13501102001025458,
+                        0.45987750211849154, 0.8068915093110925, 0.33267055295008263])
+_DB3_DEC_HI = np.array([-0.33267055295008263, 0.8068915093110925, -0.45987750211849154,
+                        -0.13501102001025458, 0.08544127388202666, 0.03522629188570953])
+
+
+@functools.lru_cache(maxsize=None)
+def _swt_plan(n_samples, level):
+    """
+    Plan of the stationary wavelet transform of the SWT detector for signals
+    of n_samples: the edge padding to a multiple of 2**level and, for every
+    level, the taps and circular shifts of its filter. The low pass filter
+    up to the last level and the high pass filter of the last level give
+    only the detail coefficients of the last level.
+    """
+    padding = -n_samples % 2**level
+    n = n_samples + padding
+    steps = []
+    for j in range(level):
+        taps = _DB3_DEC_HI if j == level-1 else _DB3_DEC_LO
+        # the filter of level j+1 is upsampled by 2**j and centred like pywt
+        step = 2**j
+        shifts = [(len(taps)*step//2 - k*step) % n for k in range(len(taps))]
+        steps.append((taps, shifts))
+    return padding, steps
+
+
+def _swt_detail(x, steps):
+    """
+    Applies the circular filters of _swt_plan along the last axis.
+    """
+    n = x.shape[-1]
+    for taps, shifts in steps:
+        periodic = np.concatenate((x, x), axis=-1)
+        y = taps[0]*periodic[..., shifts[0]:shifts[0]+n]
+        for tap, shift in zip(taps[1:], shifts[1:]):
+            y += tap*periodic[..., shift:shift+n]
+        x = y
+    return x
+
+
+@functools.lru_cache(maxsize=None)
+def _butter_coefficients(order, Wn, btype):
+    """
+    Memoised signal.butter(order, Wn, btype) as (b, a). Wn has to be a number or a tuple.
+    The arrays are shared by all detectors and read-only.
+    """
+    b, a = signal.butter(order, Wn, btype=btype)
+    b.flags.writeable = False
+    a.flags.writeable = False
+    return b, a
+
+
+def _christov_averages(fs):
+    """
+    Coefficients of the 3 moving averages of the Christov detector.
+    """
+    return [np.ones(int(duration*fs))/int(duration*fs) for duration in (0.02, 0.028, 0.040)]
+
+
+def _engzee_filters(fs):
+    """
+    50 Hz bandstop (b, a) and low pass coefficients of the Engzee detector.
+    """
+    f1 = 48/fs
+    f2 = 52/fs
+    return _butter_coefficients(4, (f1*2, f2*2), 'bandstop'), [1,4,6,4,1]
+
+
+class _ChristovThreshold:
+    """
+    Adaptive threshold M+F+R of the Christov detector. process() takes the next
+    samples of MA3 and returns the QRS found in them (including the 1st one),
+    so MA3 can be fed in one piece or block by block with the same result.
+    """
+
+    def __init__(self, fs):
+        self.fs = fs
+        self.ms50 = int(0.05*fs)
+        self.ms200 = int(0.2*fs)
+        self.ms1200 = int(1.2*fs)
+        self.ms350 = int(0.35*fs)
+        self.M_slope = np.linspace(1.0, 0.6, self.ms1200-self.ms200).tolist()
+
+        ## Index of the next sample
+        self.i = 0
+        self.M = 0
+        self.newM5 = 0
+        self.MM = []
+        self.MM_mean = None
+        self.F = 0.0
+        self.R = 0
+        self.RR = []
+        self.Rm = 0
+        ## The last 2 QRS
+        self.QRS = []
+        ## Maximum of MA3 up to the sample and since the last QRS
+        self.max_all = -np.inf
+        self.max_qrs = -np.inf
+        ## Last ms350 samples of MA3 for F
+        self.tail = np.zeros(0)
+
+    def _F(self, MA3):
+        # F rises with the maximum of the latest 50 ms and falls with the one 350 ms back
+        ms50, ms350 = self.ms50, self.ms350
+        extended = np.concatenate((self.tail, MA3))
+        offset = self.i-len(self.tail)
+        self.tail = extended[-ms350:] if ms350 > 0 else extended[:0]
+
+        index = np.arange(self.i, self.i+len(MA3))
+        steps = np.zeros(len(MA3))
+        index_F = index[index > ms350]
+        if len(index_F):
+            window_max = np.lib.stride_tricks.sliding_window_view(extended, ms50).max(axis=-1)
+            steps[index > ms350] = (window_max[index_F-ms50-offset]-window_max[index_F-ms350-offset])/150.0
+        return np.cumsum(np.concatenate(([self.F], steps)))[1:]
+
+    def process(self, MA3):
+        MA3 = np.asarray(MA3, dtype=float)
+        F_all = self._F(MA3)
+
+        fs, ms200, ms1200 = self.fs, self.ms200, self.ms1200
+        M, newM5, MM, MM_mean, R = self.M, self.newM5, self.MM, self.MM_mean, self.R
+        RR, Rm, QRS = self.RR, self.Rm, self.QRS
+        max_all, max_qrs = self.max_all, self.max_qrs
+        found = []
+
+        for i, value, F in zip(range(self.i, self.i+len(MA3)), MA3.tolist(), F_all.tolist()):
+
+            # M
+            if i < 5*fs:
+                if value > max_all:
+                    max_all = value
+                M = 0.6*max_all
+                MM.append(M)
+                if len(MM)>5:
+                    MM.pop(0)
+                MM_mean = None
+
+            elif QRS and i < QRS[-1]+ms200:
+                newM5 = 0.6*max_qrs
+                if newM5>1.5*MM[-1]:
+                    newM5 = 1.1*MM[-1]
+
+            elif QRS and i == QRS[-1]+ms200:
+                if newM5==0:
+                    newM5 = MM[-1]
+                MM.append(newM5)
+                if len(MM)>5:
+                    MM.pop(0)
+                MM_mean = float(np.mean(MM))
+                M = MM_mean
+
+            elif QRS and i > QRS[-1]+ms200 and i < QRS[-1]+ms1200:
+                if MM_mean is None:
+                    MM_mean = float(np.mean(MM))
+                M = MM_mean*self.M_slope[i-(QRS[-1]+ms200)]
+
+            elif QRS and i > QRS[-1]+ms1200:
+                if MM_mean is None:
+                    MM_mean = float(np.mean(MM))
+                M = 0.6*MM_mean
+
+            # R
+            if QRS and i < QRS[-1]+int((2.0/3.0*Rm)):
+                R = 0
+
+            elif QRS and i > QRS[-1]+int((2.0/3.0*Rm)) and i < QRS[-1]+Rm:
+                if MM_mean is None:
+                    MM_mean = float(np.mean(MM))
+                R = (M-MM_mean)/1.4
+
+            MFR = M+F+R
+
+            if (not QRS and value>MFR) or (QRS and i > QRS[-1]+ms200 and value>MFR):
+                QRS.append(i)
+                found.append(i)
+                max_qrs = value
+                if len(QRS)>2:
+                    RR.append(QRS[-1]-QRS[-2])
+                    if len(RR)>5:
+                        RR.pop(0)
+                    Rm = int(np.mean(RR))
+                    QRS.pop(0)
+            elif value > max_qrs:
+                max_qrs = value
+
+        self.i += len(MA3)
+        self.M, self.newM5, self.MM_mean, self.R, self.Rm = M, newM5, MM_mean, R, Rm
+        self.max_all, self.max_qrs = max_all, max_qrs
+        if len(F_all):
+            self.F = F_all[-1]
+
+        return found
+
+
+class _EngzeeThreshold:
+    """
+    Thresholding of the Engzee detector. process() takes the next samples of
+    the low pass signal and of the unfiltered ECG and returns the r-peaks found
+    in them (including the 1st one), so the recording can be fed in one piece
+    or block by block with the same result.
+    """
+
+    def __init__(self, fs, fake_delay=0):
+        self.fs = fs
+        self.fake_delay = fake_delay
+        self.ms10 = int(0.01*fs)
+        self.ms200 = int(0.2*fs)
+        self.ms1200 = int(1.2*fs)
+        self.ms160 = int(0.16*fs)
+        self.neg_threshold = int(0.01*fs)
+        self.M_slope = np.linspace(1.0, 0.6, self.ms1200-self.ms200).tolist()
+
+        ## Index of the next sample
+        self.i = 0
+        self.M = 0
+        self.MM = []
+        self.MM_mean = None
+        self.newM5 = False
+        ## The last QRS onset
+        self.QRS = []
+        self.counter = 0
+        self.thi = False
+        self.thf = False
+        self.previous = 0.0
+        ## Maximum of low_pass up to the sample and since the last QRS
+        self.max_all = -np.inf
+        self.max_qrs = -np.inf
+        ## Unfiltered ECG back to the earliest possible start of the r-peak search
+        self.tail = np.zeros(0)
+
+    def process(self, low_pass, unfiltered_ecg):
+        unfiltered_ecg = np.concatenate((self.tail, np.asarray(unfiltered_ecg, dtype=float)))
+        offset = self.i-len(self.tail)
+        self.tail = unfiltered_ecg[-(self.ms200+self.ms10):]
+
+        fs, ms10, ms200, ms1200, ms160 = self.fs, self.ms10, self.ms200, self.ms1200, self.ms160
+        M, MM, MM_mean, newM5, QRS = self.M, self.MM, self.MM_mean, self.newM5, self.QRS
+        counter, thi, thf, previous = self.counter, self.thi, self.thf, self.previous
+        max_all, max_qrs = self.max_all, self.max_qrs
+        r_peaks = []
+
+        for i, value in zip(range(self.i, self.i+len(low_pass)), np.asarray(low_pass, dtype=float).tolist()):
+
+            # M
+            if i < 5*fs:
+                if value > max_all:
+                    max_all = value
+                M = 0.6*max_all
+                MM.append(M)
+                if len(MM)>5:
+                    MM.pop(0)
+                MM_mean = None
+
+            elif QRS and i < QRS[-1]+ms200:
+
+                newM5 = 0.6*max_qrs
+
+                if newM5>1.5*MM[-1]:
+                    newM5 = 1.1*MM[-1]
+
+            elif newM5 and QRS and i == QRS[-1]+ms200:
+                MM.append(newM5)
+                if len(MM)>5:
+                    MM.pop(0)
+                MM_mean = float(np.mean(MM))
+                M = MM_mean
+
+            elif QRS and i > QRS[-1]+ms200 and i < QRS[-1]+ms1200:
+                if MM_mean is None:
+                    MM_mean = float(np.mean(MM))
+                M = MM_mean*self.M_slope[i-(QRS[-1]+ms200)]
+
+            elif QRS and i > QRS[-1]+ms1200:
+                if MM_mean is None:
+                    MM_mean = float(np.mean(MM))
+                M = 0.6*MM_mean
+
+            if (not QRS and value>M) or (QRS and i > QRS[-1]+ms200 and value>M):
+                QRS[:] = [i]
+                thi = True
+                max_qrs = value
+            elif value > max_qrs:
+                max_qrs = value
+
+            if thi and i<QRS[-1]+ms160:
+                if value<-M and previous>-M:
+                    thf = True
+                    
+                if thf and value<-M:
+                    counter += 1
+                
+                elif value>-M and thf:
+                    counter = 0
+                    thi = False
+                    thf = False
+            
+            elif thi and i>QRS[-1]+ms160:
+                    counter = 0
+                    thi = False
+                    thf = False                                        
+            
+            if counter>self.neg_threshold:
+                unfiltered_section = unfiltered_ecg[QRS[-1]-ms10-offset:i-offset]
+                r_peaks.append(self.fake_delay+
+                               np.argmax(unfiltered_section)+QRS[-1]-ms10)
+                counter = 0
+                thi = False
+                thf = False
+
+            previous = value
+
+        self.i += len(low_pass)
+        self.M, self.MM_mean, self.newM5 = M, MM_mean, newM5
+        self.counter, self.thi, self.thf, self.previous = counter, thi, thf, previous
+        self.max_all, self.max_qrs = max_all, max_qrs
+
+        return r_peaks
+
+
+class _StreamFIR:
+    """
+    FIR filter fed block by block. signal.lfilter(b, [1], x) filters with
+    np.convolve, which rounds differently from a filter state (zi), so the
+    outputs are computed with np.convolve from the last len(b)-1 inputs.
+    """
+
+    def __init__(self, b):
+        self.b = np.asarray(b, dtype=float)
+        ## Last len(b)-1 inputs followed by the ones not filtered yet
+        self.x = np.zeros(0)
+        self.filtered = 0
+
+    def push(self, samples):
+        x = np.concatenate((self.x, samples))
+        # np.convolve swaps its arguments when the signal is the longer one, as it is for a recording
+        if len(x) <= len(self.b):
+            self.x = x
+            return np.zeros(0)
+        out = np.convolve(self.b, x)[self.filtered:len(x)]
+        self.x = x[len(x)-(len(self.b)-1):]
+        self.filtered = len(self.x)
+        return out
+
+
+class ChristovStream:
+    """
+    Christov detector for a live feed: push() takes the next samples of a
+    single channel ECG and returns the QRS found in them. The filters and the
+    threshold keep their state between calls, so pushing a recording in chunks
+    gives the same QRS as christov_detector on the whole recording.
+    """
+
+    def __init__(self, sampling_frequency):
+        self.fs = sampling_frequency
+        self.averages = _christov_averages(self.fs)
+        self.total_taps = sum(len(b) for b in self.averages)
+        self.filters = [_StreamFIR(b) for b in self.averages]
+        ## Last 2 samples of MA2 for Y
+        self.MA2_tail = np.zeros(0)
+        self.threshold = _ChristovThreshold(self.fs)
+        self.first_detection = True
+
+    def push(self, samples):
+        MA1 = self.filters[0].push(samples)
+        MA2 = self.filters[1].push(MA1)
+
+        MA2 = np.concatenate((self.MA2_tail, MA2))
+        self.MA2_tail = MA2[-2:]
+        Y = abs(MA2[2:]-MA2[:-2])
+
+        MA3 = self.filters[2].push(Y)
+        MA3[:max(0, self.total_taps-self.threshold.i)] = 0
+
+        QRS = self.threshold.process(MA3)
+        # the 1st detection is dropped as in christov_detector
+        if QRS and self.first_detection:
+            QRS.pop(0)
+            self.first_detection = False
+        return QRS
+
+
+class EngzeeStream:
+    """
+    Engzee detector for a live feed: push() takes the next samples of a
+    single channel ECG and returns the r-peaks found in them. The filters and
+    the threshold keep their state between calls, so pushing a recording in
+    chunks gives the same r-peaks as engzee_detector on the whole recording.
+    """
+
+    def __init__(self, sampling_frequency, fake_delay=0):
+        self.fs = sampling_frequency
+        (self.b, self.a), self.ci = _engzee_filters(self.fs)
+        self.zi_bandstop = np.zeros(max(len(self.a), len(self.b))-1)
+        self.low_pass = _StreamFIR(self.ci)
+        ## Number of samples so far
+        self.n = 0
+        ## Last 4 samples of the bandstop output for the difference
+        self.filtered_tail = np.zeros(0)
+        ## Unfiltered samples waiting for their low pass output
+        self.unfiltered_ecg = np.zeros(0)
+        self.threshold = _EngzeeThreshold(self.fs, fake_delay)
+        self.first_detection = True
+
+    def push(self, samples):
+        filtered_ecg, self.zi_bandstop = signal.lfilter(self.b, self.a, samples, zi=self.zi_bandstop)
+
+        extended = np.concatenate((self.filtered_tail, filtered_ecg))
+        self.filtered_tail = extended[-4:]
+        index = np.arange(self.n, self.n+len(filtered_ecg))
+        position = index-(self.n-(len(extended)-len(filtered_ecg)))
+        diff = np.zeros(len(filtered_ecg))
+        diff[index >= 4] = extended[position[index >= 4]]-extended[position[index >= 4]-4]
+
+        self.n += len(filtered_ecg)
+
+        low_pass = self.low_pass.push(diff)
+        low_pass[:max(0, int(0.2*self.fs)-self.threshold.i)] = 0
+
+        unfiltered_ecg = np.concatenate((self.unfiltered_ecg, samples))
+        self.unfiltered_ecg = unfiltered_ecg[len(low_pass):]
+
+        r_peaks = self.threshold.process(low_pass, unfiltered_ecg[:len(low_pass)])
+        # the 1st detection is dropped as in engzee_detector
+        if r_peaks and self.first_detection:
+            r_peaks.pop(0)
+            self.first_detection = False
+        return r_peaks
+
+
+
+class _HamiltonThreshold:
+    """
+    Thresholding of the Hamilton detector. process() takes the next candidate
+    peaks (strict local maxima of ma) with their values and returns the QRS
+    found, missed beats come after the QRS whose RR interval revealed them.
+    """
+
+    def __init__(self, fs):
+        self.fs = fs
+        ## The last 8 noise peaks
+        self.n_pks = collections.deque(maxlen=8)
+        self.n_pks_ave = 0.0
+        ## s_pks is never shortened (its pop depends on len(n_pks)>8, which
+        ## does not happen), so its average is over all signal peaks
+        self.s_pks_sum = 0.0
+        self.s_pks_count = 0
+        self.s_pks_ave = 0.0
+        ## The last QRS, in order, starting with the 0 placeholder
+        self.QRS = [0]
+        ## The last 8 RR intervals
+        self.RR = collections.deque(maxlen=8)
+        self.RR_ave = 0.0
+        self.th = 0.0
+        ## Sample indices of the detected QRS, the missed beat search uses them as positions in peaks
+        self.idx = []
+        ## Candidate peaks from position peaks_offset on
+        self.peaks = []
+        self.values = []
+        self.peaks_offset = 0
+
+    def process(self, peaks, values):
+        fs, QRS, idx = self.fs, self.QRS, self.idx
+        found = []
+
+        for peak, value in zip(peaks, values):
+            self.peaks.append(peak)
+            self.values.append(value)
+
+            if value > self.th and (peak-QRS[-1])>0.3*fs:
+                QRS.append(peak)
+                found.append(peak)
+                idx.append(peak)
+                self.s_pks_sum += value
+                self.s_pks_count += 1
+                self.s_pks_ave = self.s_pks_sum/self.s_pks_count
+
+                if self.RR_ave != 0.0:
+                    if QRS[-1]-QRS[-2] > 1.5*self.RR_ave:
+                        start = idx[-2]+1-self.peaks_offset
+                        missed_peaks = self.peaks[start:idx[-1]-self.peaks_offset]
+                        missed_values = self.values[start:idx[-1]-self.peaks_offset]
+                        for missed_peak, missed_value in zip(missed_peaks, missed_values):
+                            if missed_peak-self.peaks[start-1]>int(0.360*fs) and missed_value>0.5*self.th:
+                                QRS.append(missed_peak)
+                                QRS.sort()
+                                found.append(missed_peak)
+                                break
+
+                if len(QRS)>2:
+                    self.RR.append(QRS[-1]-QRS[-2])
+                    self.RR_ave = int(sum(self.RR)/len(self.RR))
+
+                # positions before idx[-1] are never looked at again
+                drop = min(idx[-1]-self.peaks_offset, len(self.peaks))
+                if drop > 0:
+                    del self.peaks[:drop]
+                    del self.values[:drop]
+                    self.peaks_offset += drop
+                del QRS[:-3]
+                del idx[:-2]
+
+            else:
+                self.n_pks.append(value)
+                self.n_pks_ave = sum(self.n_pks)/len(self.n_pks)
+
+            self.th = self.n_pks_ave + 0.45*(self.s_pks_ave-self.n_pks_ave)
+
+        return found
+
+
+class _PanThreshold:
+    """
+    Thresholding of panPeakDetect. process() takes the next candidate peaks
+    (strict local maxima) with their values and returns the signal peaks
+    found, a missed peak comes right before the peak that revealed it.
+    """
+
+    def __init__(self, fs):
+        self.fs = fs
+        self.min_distance = int(0.25*fs)
+        ## The last 9 signal peaks, starting with the 0 placeholder
+        self.signal_peaks = [0]
+        self.SPKI = 0.0
+        self.NPKI = 0.0
+        self.threshold_I1 = 0.0
+        self.threshold_I2 = 0.0
+        self.RR_missed = 0
+        ## Candidates since the last signal peak for the missed peak search
+        self.peaks = []
+        self.values = []
+
+    def process(self, peaks, values):
+        fs, signal_peaks = self.fs, self.signal_peaks
+        found = []
+
+        for peak, value in zip(peaks, values):
+
+            if value>self.threshold_I1 and (peak-signal_peaks[-1])>0.3*fs:
+                    
+                signal_peaks.append(peak)
+                found.append(peak)
+                self.SPKI = 0.125*value + 0.875*self.SPKI
+                if self.RR_missed!=0:
+                    if signal_peaks[-1]-signal_peaks[-2]>self.RR_missed:
+                        missed_peak = None
+                        for candidate, candidate_value in zip(self.peaks[1:], self.values[1:]):
+                            if candidate-signal_peaks[-2]>self.min_distance and signal_peaks[-1]-candidate>self.min_distance and candidate_value>self.threshold_I2:
+                                # the first of equal maxima as with np.argmax
+                                if missed_peak is None or candidate_value>missed_value:
+                                    missed_peak, missed_value = candidate, candidate_value
+
+                        if missed_peak is not None:           
+                            signal_peaks.append(signal_peaks[-1])
+                            signal_peaks[-2] = missed_peak   
+                            found[-1:] = [missed_peak, peak]
+
+                self.peaks = [peak]
+                self.values = [value]
+
+            else:
+                if self.peaks:
+                    self.peaks.append(peak)
+                    self.values.append(value)
+                self.NPKI = 0.125*value + 0.875*self.NPKI
+
+            self.threshold_I1 = self.NPKI + 0.25*(self.SPKI-self.NPKI)
+            self.threshold_I2 = 0.5*self.threshold_I1
+
+            if len(signal_peaks)>8:
+                # mean of np.diff(signal_peaks[-9:])
+                RR_ave = int((signal_peaks[-1]-signal_peaks[-9])/8)
+                self.RR_missed = int(1.66*RR_ave)
+                del signal_peaks[:-9]
+
+        return found
+
+
+class _StreamPeaks:
+    """
+    Candidate peaks (strict local maxima) of a signal fed block by block. A
+    sample is a candidate once the next sample is known.
+    """
+
+    def __init__(self):
+        ## Last 2 samples
+        self.tail = np.zeros(0)
+        ## Number of samples so far
+        self.n = 0
+
+    def push(self, x):
+        extended = np.concatenate((self.tail, x))
+        start = self.n-len(self.tail)
+        self.tail = extended[-2:]
+        self.n += len(x)
+        peaks = np.flatnonzero((extended[1:-1] > extended[:-2]) & (extended[1:-1] > extended[2:])) + 1
+        return (peaks+start).tolist(), extended[peaks].tolist()
+
+
+class _StreamMWA:
+    """
+    MWA_cumulative fed block by block. The running cumulative sum and its last
+    window_size values are kept, so the rounding is the same as on the whole signal.
+    """
+
+    def __init__(self, window_size):
+        self.window_size = window_size
+        self.total = 0.0
+        self.history = np.zeros(0)
+        ## Number of samples so far
+        self.n = 0
+
+    def push(self, x):
+        window_size = self.window_size
+        cumulative = np.cumsum(np.concatenate(([self.total], x)))[1:]
+        extended = np.concatenate((self.history, cumulative))
+        start = self.n-len(self.history)
+        index = np.arange(self.n, self.n+len(x))
+
+        ret = cumulative.copy()
+        full = index >= window_size
+        ret[full] = cumulative[full] - extended[index[full]-window_size-start]
+        ramp = index < window_size-1
+        ret[ramp] = ret[ramp] / (index[ramp]+1)
+        ret[~ramp] = ret[~ramp] / window_size
+
+        self.history = extended[-window_size:]
+        self.n += len(x)
+        if len(x):
+            self.total = cumulative[-1]
+        return ret
+
+
+class StreamingDetector:
+    """
+    Pan Tompkins, Hamilton or two average detector for a live feed: push()
+    takes the next samples of a single channel ECG and returns the beats found
+    in them, with the sample indices of the detector on the whole recording.
+    The IIR filter states, the moving averages and the thresholds are kept
+    between calls instead of filtering the whole buffer again.
+
+    A beat is returned one sample after its peak in the detection signal
+    (pan_tompkins, hamilton) or at the end of its block (two_average). Missed
+    beats found by the search back of Pan Tompkins and Hamilton are returned
+    together with the beat that revealed them, so they can be up to about
+    1.66 RR intervals late.
+    Two average has no global maximum of the filtered ECG to compare with, so
+    it only differs from two_average_detector if that maximum is 0.
+    """
+
+    def __init__(self, sampling_frequency, detector='pan_tompkins'):
+        self.fs = sampling_frequency
+        self.detector = detector
+        if detector == 'pan_tompkins':
+            self.b, self.a = _butter_coefficients(1, (5/self.fs*2, 15/self.fs*2), 'bandpass')
+            self.mwa = _StreamMWA(int(0.150*self.fs))
+            self.zero = int(0.150*self.fs*2)
+            self.threshold = _PanThreshold(self.fs)
+        elif detector == 'hamilton':
+            self.b, self.a = _butter_coefficients(1, (8/self.fs*2, 16/self.fs*2), 'bandpass')
+            average = np.ones(int(0.08*self.fs))/int(0.08*self.fs)
+            self.ma = _StreamFIR(average)
+            self.zero = len(average)*2
+            self.threshold = _HamiltonThreshold(self.fs)
+        elif detector == 'two_average':
+            self.b, self.a = _butter_coefficients(2, (8/self.fs*2, 20/self.fs*2), 'bandpass')
+            self.mwa_qrs = _StreamMWA(int(0.12*self.fs))
+            self.mwa_beat = _StreamMWA(int(0.6*self.fs))
+            self.QRS = []
+            ## Previous sample of the block mask and the open block
+            self.block = None
+            self.block_start = None
+            self.block_ecg = np.zeros(0)
+        else:
+            raise RuntimeError('invalid streaming detector!')
+
+        self.zi = np.zeros(max(len(self.a), len(self.b))-1)
+        ## Last sample of the filtered ECG for np.diff
+        self.last = np.zeros(0)
+        self.peaks = _StreamPeaks()
+
+    def push(self, samples):
+        # signal.lfilter with a state does not take empty arrays
+        if len(samples) == 0:
+            return []
+        filtered_ecg, self.zi = signal.lfilter(self.b, self.a, samples, zi=self.zi)
+
+        if self.detector == 'two_average':
+            return self._two_average(filtered_ecg)
+
+        extended = np.concatenate((self.last, filtered_ecg))
+        self.last = extended[-1:]
+        diff = np.diff(extended)
+
+        if self.detector == 'pan_tompkins':
+            start = self.mwa.n
+            detection = self.mwa.push(diff*diff)
+        else:
+            start = self.peaks.n
+            detection = self.ma.push(abs(diff))
+        detection[:max(0, self.zero-start)] = 0
+
+        return self.threshold.process(*self.peaks.push(detection))
+
+    def _two_average(self, filtered_ecg):
+        start = self.mwa_qrs.n
+        blocks = self.mwa_qrs.push(abs(filtered_ecg)) > self.mwa_beat.push(abs(filtered_ecg))
+
+        if len(blocks) == 0:
+            return []
+
+        extended = np.concatenate((self.block_ecg, filtered_ecg))
+        extended_start = start-len(self.block_ecg)
+        # no edge at the 1st sample
+        previous = np.concatenate(([blocks[0] if self.block is None else self.block], blocks[:-1]))
+        edges = np.flatnonzero(previous != blocks)
+
+        found = []
+        for edge in edges.tolist():
+            i = start+edge
+            if blocks[edge]:
+                self.block_start = i
+            elif self.block_start is not None:
+                end = i-1
+                if end-self.block_start>int(0.08*self.fs):
+                    detection = np.argmax(extended[self.block_start-extended_start:end+1-extended_start])+self.block_start
+                    if not self.QRS or detection-self.QRS[-1]>int(0.3*self.fs):
+                        self.QRS[:] = [detection]
+                        found.append(detection)
+                self.block_start = None
+
+        self.block = blocks[-1]
+        # keep the filtered ECG of the open block for its maximum
+        keep = start+len(filtered_ecg)-self.block_start if self.block_start is not None else 0
+        self.block_ecg = extended[len(extended)-keep:]
+        return found
+
+
+def _for_each_channel(detect, *arrays, empty=()):
+    """
+    Runs the per channel part of a detector: once for 1D arrays, otherwise
+    for every row of the arrays and returns the list of results. For rows,
+    a channel where detect raises one of the exceptions in empty gives [],
+    so that e.g. one flat lead does not lose the peaks of the other leads.
+    1D arrays raise as before.
+    """
+    if np.ndim(arrays[0]) == 1:
+        return detect(*arrays)
+    results = []
+    for rows in zip(*arrays):
+        try:
+            results.append(detect(*rows))
+        except empty:
+            results.append([])
+    return results
+
 
 def MWA_from_name(function_name):
     if function_name == "cumulative":
@@ -592,18 +1135,21 @@ def MWA_from_name(function_name):
 #Fast implementation of moving window average with numpy's cumsum function 
 def MWA_cumulative(input_array, window_size):
     
-    ret = np.cumsum(input_array, dtype=float)
-    ret[window_size:] = ret[window_size:] - ret[:-window_size]
+    ret = np.cumsum(input_array, axis=-1, dtype=float)
+    ret[..., window_size:] = ret[..., window_size:] - ret[..., :-window_size]
     
     for i in range(1,window_size):
-        ret[i-1] = ret[i-1] / i
-    ret[window_size - 1:]  = ret[window_size - 1:] / window_size
+        ret[..., i-1] = ret[..., i-1] / i
+    ret[..., window_size - 1:]  = ret[..., window_size - 1:] / window_size
     
     return ret
 
 #Original Function 
 def MWA_original(input_array, window_size):
 
+    if np.ndim(input_array) > 1:
+        return np.apply_along_axis(MWA_original, -1, input_array, window_size)
+
     mwa = np.zeros(len(input_array))
     mwa[0] = input_array[0]
     
@@ -619,6 +1165,9 @@ def MWA_original(input_array, window_size):
 
 #Fast moving window average implemented with 1D convolution 
 def MWA_convolve(input_array, window_size):
+
+    if np.ndim(input_array) > 1:
+        return np.apply_along_axis(MWA_convolve, -1, input_array, window_size)
     
     ret = np.pad(input_array, (window_size-1,0), 'constant', constant_values=(0,0))
     ret = np.convolve(ret,np.ones(window_size),'valid')
@@ -639,64 +1188,8 @@ def normalise(input_array):
 
 def panPeakDetect(detection, fs):    
 
-    min_distance = int(0.25*fs)
-
-    signal_peaks = [0]
-    noise_peaks = []
-
-    SPKI = 0.0
-    NPKI = 0.0
-
-    threshold_I1 = 0.0
-    threshold_I2 = 0.0
-
-    RR_missed = 0
-    index = 0
-    indexes = []
-
-    missed_peaks = []
-    peaks = []
-
-    for i in range(len(detection)):
-
-        if i>0 and i<len(detection)-1:
-            if detection[i-1]<detection[i] and detection[i+1]<detection[i]:
-                peak = i
-                peaks.append(i)
-
-                if detection[peak]>threshold_I1 and (peak-signal_peaks[-1])>0.3*fs:
-                        
-                    signal_peaks.append(peak)
-                    indexes.append(index)
-                    SPKI = 0.125*detection[signal_peaks[-1]] + 0.875*SPKI
-                    if RR_missed!=0:
-                        if signal_peaks[-1]-signal_peaks[-2]>RR_missed:
-                            missed_section_peaks = peaks[indexes[-2]+1:indexes[-1]]
-                            missed_section_peaks2 = []
-                            for missed_peak in missed_section_peaks:
-                                if missed_peak-signal_peaks[-2]>min_distance and signal_peaks[-1]-missed_peak>min_distance and detection[missed_peak]>threshold_I2:
-                                    missed_section_peaks2.append(missed_peak)
-
-                            if len(missed_section_peaks2)>0:           
-                                missed_peak = missed_section_peaks2[np.argmax(detection[missed_section_peaks2])]
-                                missed_peaks.append(missed_peak)
-                                signal_peaks.append(signal_peaks[-1])
-                                signal_peaks[-2] = missed_peak   
-
-                else:
-                    noise_peaks.append(peak)
-                    NPKI = 0.125*detection[noise_peaks[-1]] + 0.875*NPKI
-
-                threshold_I1 = NPKI + 0.25*(SPKI-NPKI)
-                threshold_I2 = 0.5*threshold_I1
-
-                if len(signal_peaks)>8:
-                    RR = np.diff(signal_peaks[-9:])
-                    RR_ave = int(np.mean(RR))
-                    RR_missed = int(1.66*RR_ave)
-
-                index = index+1      
-    
-    signal_peaks.pop(0)
+    # Candidate peaks are the strict local maxima, the thresholds only change at these samples
+    detection = np.asarray(detection)
+    peaks = (np.flatnonzero((detection[1:-1] > detection[:-2]) & (detection[1:-1] > detection[2:])) + 1).tolist()
 
-    return signal_peaks
+    return _PanThreshold(fs).process(peaks, detection[peaks].tolist())
@@ -1,3 +1,4 @@
+import functools
 import numpy as np
 import scipy.signal
 from ecgdetectors import Detectors
@@ -22,31 +23,62 @@ window_length = 100      # measurements
 # endregion
 
 
+@functools.lru_cache(maxsize=None)
+def _buttord_coefficients(wp, ws, gpass, gstop, fs):
+    """
+    Memoised lowest order Butterworth low pass filter with at most gpass dB loss at wp and at
+    least gstop dB attenuation at ws, as (b, a). The arrays are shared by all calls and read-only.
+    """
+    order, normal_cutoff = scipy.signal.buttord(wp, ws, gpass, gstop, fs=fs)
+    b, a = scipy.signal.butter(order, normal_cutoff, fs=fs)
+    b.flags.writeable = False
+    a.flags.writeable = False
+    return b, a
+
+
 def high_frequency_noise_filter(data):
-    order, normal_cutoff = scipy.signal.buttord(20, 30, max_loss_passband, min_loss_stopband, fs=sampling_frequency)
-    iir_b, iir_a = scipy.signal.butter(order, normal_cutoff, fs=sampling_frequency)
+    iir_b, iir_a = _buttord_coefficients(20, 30, max_loss_passband, min_loss_stopband, sampling_frequency)
     filtered_data = scipy.signal.filtfilt(iir_b, iir_a, data)
     return filtered_data
 
 
 def baseline_filter(data):
-    order, normal_cutoff = scipy.signal.buttord(0.5, 8, max_loss_passband, min_loss_stopband, fs=sampling_frequency)
-    iir_b, iir_a = scipy.signal.butter(order, normal_cutoff, fs=sampling_frequency)
+    iir_b, iir_a = _buttord_coefficients(0.5, 8, max_loss_passband, min_loss_stopband, sampling_frequency)
     filtered_data = scipy.signal.filtfilt(iir_b, iir_a, data)
     return filtered_data
 
 
+def stationary_leads(leads, window_length, stride=10):
+    """
+    Returns a boolean array with one value per lead (row of leads), True if a
+    window of window_length samples starting at a multiple of stride is constant.
+    A window is constant if it lies in one run of equal samples, i.e. if the run
+    containing its last sample starts at or before the window start.
+    """
+    leads = np.asarray(leads)
+    n_samples = leads.shape[-1]
+    window_starts = np.arange(0, n_samples - window_length + 1, stride)
+    if len(window_starts) == 0:
+        return np.zeros(leads.shape[:-1], dtype=bool)
+    run_start = np.zeros(leads.shape, dtype=np.intp)
+    run_start[..., 1:] = np.where(leads[..., 1:] != leads[..., :-1], np.arange(1, n_samples), 0)
+    run_start = np.maximum.accumulate(run_start, axis=-1)
+    return np.any(run_start[..., window_starts + window_length - 1] <= window_starts, axis=-1)
+
+
 def stationary_signal_check(data, total_leads):
-    res = []
-    for lead in range(1, total_leads + 1):
-        window_matrix = np.lib.stride_tricks.sliding_window_view(data[lead], window_length)[::10]
-        for window in window_matrix:
-            if np.amax(window) == np.amin(window):
-                res.append(1)
-                break
-        if len(res) != lead:
-            res.append(0)
-    return res
+    return stationary_leads(np.asarray(data)[1:total_leads + 1], window_length).astype(int).tolist()
+
+
+def pan_tompkins_beats(detectors, leads):
+    """
+    Returns the Pan Tompkins beats of every lead (row of leads). All leads go to the detector in
+    one call if it takes (channels, samples) arrays (Detectors.multichannel, the toolbox copy of
+    ecgdetectors), otherwise, e.g. with the pip py-ecg-detectors, one lead per call.
+    """
+    if getattr(detectors, 'multichannel', False):
+        return detectors.pan_tompkins_detector(np.asarray(leads))
+    return [detectors.pan_tompkins_detector(lead) for lead in leads]
 
 
 def heart_rate_check(data, total_leads):
@@ -60,25 +92,87 @@ def heart_rate_check(data, total_leads):
     return res
 
 
+@functools.lru_cache(maxsize=None)
+def _band_power_weights(n_samples, fs, band):
+    """
+    Weights of the rfft bins of n_samples at fs: column 0 gives the total and
+    column 1 the in-band (band[0] <= f < band[1]) power of the one-sided
+    periodogram, which counts the bins that stand for two frequencies twice.
+    """
+    bins = np.arange(n_samples//2 + 1)
+    weights = np.full(len(bins), 2.0)
+    weights[0] = 1
+    if n_samples % 2 == 0:
+        weights[-1] = 1
+    # f = bins*fs/n_samples, compared without dividing
+    in_band = (bins*fs >= band[0]*n_samples) & (bins*fs < band[1]*n_samples)
+    weights = np.stack((weights, weights*in_band), axis=1)
+    weights.flags.writeable = False
+    return weights
+
+
+def signal_to_noise_ratio(leads, fs, band):
+    """
+    Returns the ratio of the power in band to the power outside of it for every
+    lead (row of leads), NaN for leads without power, from one rfft over all leads.
+    """
+    leads = np.asarray(leads, dtype=float)
+    # constant detrend as in scipy.signal.periodogram
+    power = np.abs(np.fft.rfft(leads - leads.mean(axis=-1, keepdims=True), axis=-1))**2
+    total_power, signal_power = np.moveaxis(power @ _band_power_weights(leads.shape[-1], fs, tuple(band)), -1, 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return signal_power / (total_power - signal_power)
+
+
 def signal_to_noise_ratio_check(data, total_leads):
-    res = []
-    for lead in range(1, total_leads + 1):
-        f, pxx_den = scipy.signal.periodogram(data[lead], fs=sampling_frequency, scaling="spectrum")
-        if sum(pxx_den):
-            signal_power = sum(pxx_den[(signal_freq_band[0]*10):(signal_freq_band[1]*10)])
-            SNR = signal_power / (sum(pxx_den) - signal_power)
-        else:
-            res.append(0)
-            continue
-        if SNR < SNR_threshold:
-            res.append(1)
-        else:
-            res.append(0)
-    return res
+    # leads without power pass, NaN < SNR_threshold is False
+    SNR = signal_to_noise_ratio(np.asarray(data)[1:total_leads + 1], sampling_frequency, signal_freq_band)
+    return (SNR < SNR_threshold).astype(int).tolist()
+
+
+def signal_quality_matrix(leads):
+    """
+    Runs the stationary signal, heart rate and signal to noise ratio checks of
+    processing1 on all leads at once.
+
+    Parameters
+    ----------
+    leads
+        Array (n_leads, samples) of the leads at sampling_frequency, without the sample index row.
 
+    Returns
+    ----------
+    SQM
+        Boolean array (3, n_leads), True where a lead fails the stationary signal,
+        heart rate or signal to noise ratio check (rows in that order).
+    """
+    leads = np.asarray(leads, dtype=float)
+    SQM = np.zeros((3, len(leads)), dtype=bool)
+    if len(leads) == 0:
+        return SQM
 
+    # stationary signal: a constant window of window_length samples starting at a multiple of 10
+    SQM[0] = stationary_leads(leads, window_length)
 
+    # heart rate: number of Pan Tompkins beats in the filtered leads
+    filtered = high_frequency_noise_filter(leads) - baseline_filter(leads)
+    n_beats = np.array([len(beats) for beats in pan_tompkins_beats(detectors, filtered)])
+    SQM[1] = (n_beats > heart_rate_limits[1]*t/60) | (n_beats < heart_rate_limits[0]*t/60)
 
+    # signal to noise ratio: power in signal_freq_band over the rest
+    SQM[2] = signal_to_noise_ratio(leads, sampling_frequency, signal_freq_band) < SNR_threshold
+
+    return SQM
+
+
+def render_glyphs(SQM):
+    """
+    Turns a signal_quality_matrix into the table of processing1: one row of
+    \u2716 (failed) and \u2714 (passed) per check and a last row that fails
+    leads failing any check.
+    """
+    rows = np.vstack((SQM, np.any(SQM, axis=0)))
+    return [[u"\u2716" if failed else u"\u2714" for failed in row] for row in rows.tolist()]
 
 
 def processing1(ECG, total_leads, temp_freq):
@@ -90,40 +184,10 @@ def processing1(ECG, total_leads, temp_freq):
     else:
         resampled_ECG = ECG
 
-    filt_ECG = [resampled_ECG[0]]
-    for lead in range(1, total_leads + 1):
-        x = high_frequency_noise_filter(ECG[lead]) - baseline_filter(ECG[lead])
-        filt_ECG.append(x)
-
-    SQM = []  # Signal Quality Matrix
-    SQM.append(stationary_signal_check(ECG, total_leads))
-    SQM.append(heart_rate_check(filt_ECG, total_leads))
-    SQM.append(signal_to_noise_ratio_check(ECG, total_leads))
-
-    combination = list("" for i in range(0, total_leads))
-    for lead in range(1, total_leads + 1):
-        combination[lead - 1] = SQM[0][lead - 1] + SQM[1][lead - 1] + SQM[2][lead - 1]
-
-    res = []
-    for x in range(0, total_leads):
-        if combination[x] >= 1:
-            combination[x] = u"\u2716"
-        else:
-            combination[x] = u"\u2714"
-
-    for y in range(0, 3):
-        SQM_print = []
-        for x in range(0, total_leads):
-            if SQM[y][x] == 1:
-                SQM_print.append(u"\u2716")
-            else:
-                SQM_print.append(u"\u2714")
-        res.append(SQM_print)
+    SQM = signal_quality_matrix(np.asarray(ECG)[1:total_leads + 1])  # Signal Quality Matrix
+    res = render_glyphs(SQM)
 
     # print(tabulate(SQM, headers=lead_name, showindex=SQM_rows))
     # print(LQI)
-    res.append(combination)
     print(time.time()-second)
     return res
-
-
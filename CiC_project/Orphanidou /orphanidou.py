@@ -1,3 +1,5 @@
+import functools
+from dataclasses import dataclass
 from scipy import signal
 import numpy as np
 import matplotlib.pyplot as plt
@@ -5,27 +7,34 @@ import matplotlib.pyplot as plt
 
 from ecgdetectors import Detectors
 
-thresh = 0.66
-
-fs=200
-
-def filter_ecg(x, fs):
-    sig = x
-    # sig = sig[:,0]
+@functools.lru_cache(maxsize=None)
+def filter_design(fs):
     order = 3
     low_cutoff = 1  # in Hz
     high_cutoff = 15  # in Hz
     cutoff_frequency = (low_cutoff, high_cutoff)
     b, a = signal.butter(order, cutoff_frequency, btype='band', fs=fs)
     # b, a = signal.butter(3, [0.004, 0.06], 'band')    # original 
+    # shared by all calls with this fs
+    b.flags.writeable = False
+    a.flags.writeable = False
+    return b, a
+
+def filter_ecg(x, fs, coefficients=None):
+    sig = x
+    # sig = sig[:,0]
+    if coefficients is None:
+        coefficients = filter_design(fs)
+    b, a = coefficients
     sig = signal.filtfilt(b, a, sig, padlen=150)
     sig = (sig - min(sig)) / (max(sig) - min(sig))
     return sig
 
-def detect_beats(sig, fs):
+def detect_beats(sig, fs, detectors=None):
     
     # detect beats
-    detectors = Detectors(fs)
+    if detectors is None:
+        detectors = Detectors(fs)
     #beats = detectors.swt_detector(sig)
     #beats = detectors.wqrs_detector(sig) 
     beats = detectors.hamilton_detector(sig)    
@@ -49,83 +58,77 @@ def find_rr_ints(beats,fs):
     
     return rr_int
 
-def assess_feasibility(beats):
+def feasibility_reasons(beats, fs, hr_limits=(40, 180), max_rr_int=3, max_rr_int_ratio=2.2):
     
-    feas = 1
+    reasons = []
     
     # find HR
     hr = 60*len(beats)/((beats[-1]-beats[0])/fs)  # in bpm
 
     # check HR
-    if hr < 40 or hr > 180:
-        print('HR out of range')
-        feas = 0
+    if hr < hr_limits[0] or hr > hr_limits[1]:
+        reasons.append('HR out of range')
         
     # find RR intervals
     rr_int = find_rr_ints(beats,fs)   # in secs
         
     # check max RR interval
-    if max(rr_int) > 3:
-        print('Max RR interval too large')
-        feas = 0
+    if max(rr_int) > max_rr_int:
+        reasons.append('Max RR interval too large')
     
     # check max to min RR interval
-    rr_int_ratio = max(rr_int)/min(rr_int)
-    if rr_int_ratio >= 2.2:
-        print('Max to min RR interval ratio too large')
+    # a zero interval (repeated beat) gives an infinite ratio instead of a division warning
+    rr_int_ratio = max(rr_int)/min(rr_int) if min(rr_int) != 0 else np.inf
+    if rr_int_ratio >= max_rr_int_ratio:
+        reasons.append('Max to min RR interval ratio too large')
+    
+    return hr, rr_int, reasons
+
+def assess_feasibility(beats, fs=200):
+    
+    feas = 1
+    for reason in feasibility_reasons(beats, fs)[2]:
+        print(reason)
         feas = 0
     
     return feas
 
 
-def calculate_template(sig, beats):
+def beat_windows(sig, beats):
     
     # find median rr interval
     med_rr_int = calculate_med_rr_int(beats)
     
     # find no. samples either side of beat
     tol = int(np.floor(med_rr_int/2))
-    sum_waves = np.zeros(1+2*tol)
-    no_beats_used = 0
-    for beat_no in range(0,len(beats)-1):
-            min_el = beats[beat_no]-tol
-            max_el = beats[beat_no]+tol
-            if min_el < 0 or max_el > beats[-1]:
-                continue
-            curr_samps = sig[min_el:max_el+1]
-            for i in range(0,len(sum_waves)):
-                sum_waves[i] += curr_samps[i]
-            no_beats_used +=1
-    templ = sum_waves/no_beats_used
+    
+    # windows of all beats but the last that lie between the start of the signal and the last beat
+    centres = np.asarray(beats[:-1], dtype=int)
+    centres = centres[(centres-tol >= 0) & (centres+tol <= beats[-1])]
+    
+    # one row per beat
+    return np.asarray(sig, dtype=float)[centres[:, None] + np.arange(-tol, tol+1)]
+
+
+def calculate_template(sig, beats):
+    
+    windows = beat_windows(sig, beats)
+    templ = windows.sum(axis=0)/len(windows)
     return templ
 
 
 def calculate_cc(sig, beats, templ):
     
-    # find median rr interval
-    med_rr_int = calculate_med_rr_int(beats)
-    
-    # find no. samples either side of beat
-    tol = int(np.floor(med_rr_int/2))
+    windows = beat_windows(sig, beats)
     
-    # calculate correlation coefficients for each beat
-    sum_cc = 0
-    no_beats_used = 0
-    for beat_no in range(0,len(beats)-1):
-            min_el = beats[beat_no]-tol
-            max_el = beats[beat_no]+tol
-            if min_el < 0 or max_el > beats[-1]:
-                continue
-            curr_samps = np.zeros(1+2*tol)
-            for i in range(0, 1+2*tol):
-                curr_samps[i] += sig[min_el+i]
-            temp = np.corrcoef(curr_samps, templ)
-            curr_cc = temp[0,1]
-            sum_cc = np.add(sum_cc, curr_cc)
-            no_beats_used +=1
+    # Pearson correlation coefficient of each beat with the template, as np.corrcoef
+    beats_centred = windows - windows.mean(axis=1, keepdims=True)
+    templ_centred = templ - templ.mean()
+    cc_beats = (beats_centred @ templ_centred) / np.sqrt((beats_centred**2).sum(axis=1) * (templ_centred @ templ_centred))
+    cc_beats = np.clip(cc_beats, -1, 1)
             
     # find average correlation coefficient
-    cc = sum_cc/no_beats_used
+    cc = cc_beats.sum()/len(cc_beats)
     return cc
 
 def compare_cc_to_thresh(cc, thresh):
@@ -147,27 +150,87 @@ def calculate_med_rr_int(beats):
     
     return med_rr_int
 
+@dataclass(frozen=True)
+class OrphanidouResult:
+    """
+    Result of OrphanidouSQI.assess for one signal: quality is 1 for an
+    acceptable signal and 0 otherwise, reasons says why it was rejected
+    (empty if accepted) and beats holds the refined R peaks in samples.
+    hr (bpm) and rr_min, rr_max and rr_median (s) are None if too few
+    beats were detected. cc, the average correlation of the beats with
+    the template, is None if the beats were not feasible or none of them
+    has a complete window for the template.
+    """
+    quality: int
+    reasons: tuple = ()
+    beats: tuple = ()
+    hr: float = None
+    rr_min: float = None
+    rr_max: float = None
+    rr_median: float = None
+    cc: float = None
+
+
+class OrphanidouSQI:
+    """
+    Orphanidou signal quality index of a single lead ECG sampled at fs:
+    the beats have to give a plausible HR and RR intervals, then their
+    average correlation with the template beat has to reach thresh.
+    The filter and the beat detector are set up once. assess() keeps no
+    state, so one object can be used from several threads, and it is
+    pickled by its parameters for process pools.
+    """
+
+    def __init__(self, fs=200, thresh=0.66, hr_limits=(40, 180), max_rr_int=3, max_rr_int_ratio=2.2):
+        self.fs = fs
+        self.thresh = thresh
+        self.hr_limits = tuple(hr_limits)
+        self.max_rr_int = max_rr_int
+        self.max_rr_int_ratio = max_rr_int_ratio
+        self.coefficients = filter_design(fs)
+        self.detectors = Detectors(fs)
+
+    def __reduce__(self):
+        return (OrphanidouSQI, (self.fs, self.thresh, self.hr_limits, self.max_rr_int, self.max_rr_int_ratio))
+
+    def assess(self, x):
+        
+        # filter ECG
+        sig = filter_ecg(x, self.fs, self.coefficients)
+        
+        # detect beats
+        beats = detect_beats(sig, self.fs, self.detectors)
+        if len(beats) < 2 or beats[-1] == beats[0]:
+            return OrphanidouResult(0, ('Too few beats detected',), tuple(int(beat) for beat in beats))
+        
+        # assess feasibility of beat detections
+        hr, rr_int, reasons = feasibility_reasons(beats, self.fs, self.hr_limits, self.max_rr_int, self.max_rr_int_ratio)
+        stats = dict(beats=tuple(int(beat) for beat in beats), hr=float(hr), rr_min=float(min(rr_int)),
+                     rr_max=float(max(rr_int)), rr_median=float(np.median(rr_int)))
+        if reasons:
+            return OrphanidouResult(0, tuple(reasons), **stats)
+        
+        # the template needs a beat whose window lies between the start of the signal and the last beat
+        if len(beat_windows(x, beats)) == 0:
+            return OrphanidouResult(0, ('No complete beat windows',), **stats)
+        
+        # create template beat shape
+        templ = calculate_template(x, beats)
+        
+        # calculate correlation coefficient
+        cc = float(calculate_cc(x, beats, templ))
+        
+        # compare correlation coefficient to threshold
+        qual = compare_cc_to_thresh(cc, self.thresh)
+        reasons = () if qual else ('Correlation coefficient below threshold',)
+        
+        return OrphanidouResult(qual, reasons, cc=cc, **stats)
+
+
+@functools.lru_cache(maxsize=None)
+def _sqi(fs, thresh):
+    return OrphanidouSQI(fs, thresh)
+
 def assess_qual(x, fs, thresh):
     
-    # filter ECG
-    sig = filter_ecg(x, fs)
-    
-    # detect beats
-    beats = detect_beats(sig, fs)
-    
-    # assess feasibility of beat detections
-    feas = assess_feasibility(beats)
-    if feas == 0:
-        qual = 0
-        return qual
-    
-    # create template beat shape
-    templ = calculate_template(x, beats)
-    
-    # calculate correlation coefficient
-    cc = calculate_cc(x, beats, templ)
-    
-    # compare correlation coefficient to threshold
-    qual = compare_cc_to_thresh(cc, thresh)
-
-    return qual
\ No newline at end of file
+    return _sqi(fs, thresh).assess(x).quality
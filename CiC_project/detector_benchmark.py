@@ -0,0 +1,327 @@
+"""
+Benchmark of the beat detectors in Detectors.detector_list (toolbox/ecgdetectors.py).
+
+Every detector is run on the leads of the ECGAssess 'set-a' recordings (500 Hz) and on
+synthetic ECGGenerator signals, whose R peaks are known from peak_labels == 0.6.
+For every detector and data set the results hold the throughput (samples/second), the
+latency percentiles of one call, the peak memory of one call and, on the synthetic
+signals, the sensitivity and positive predictive value (PPV). They are written to a
+JSON file so that runs can be compared to find regressions.
+
+The detected peaks on the set-a leads can also be stored and later compared against the
+stored ones, to check that a rewrite of a detector gives the same output.
+
+The NSTDB artifact records are downloaded from PhysioNet unless the NSTDB_DIR (local copy of
+the database) or NSTDB_CACHE_DIR (resampled records, written on first use) environment
+variables are set, see NoiseGenerator._load_noise.
+
+Example:
+    python detector_benchmark.py --records 100 --synthetic 100 --seed 0 --out saved_data/detector_benchmark.json
+    python detector_benchmark.py --records 20 --check-peaks saved_data/detector_peaks_set_a.json
+"""
+import argparse
+import contextlib
+import glob
+import io
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import scipy
+
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+GENERATOR_DIR = os.path.join(PROJECT_DIR, 'framework_for_synthetic_biosignals')
+TOOLBOX_DIR = os.path.join(PROJECT_DIR, 'Automated_ecg_assessment_og', 'toolbox')
+SET_A_DIR = os.path.join(PROJECT_DIR, 'ECGAssess_og', 'set-a')
+
+# the toolbox copy of ecgdetectors, not an installed py-ecg-detectors
+sys.path.insert(0, TOOLBOX_DIR)
+from ecgdetectors import Detectors
+
+
+def load_set_a(n_records=None):
+    """
+    Returns the leads of the first n_records set-a recordings (all if None) as a list of 1D arrays.
+    """
+    leads = []
+    for file in sorted(glob.glob(os.path.join(SET_A_DIR, '*.txt')))[:n_records]:
+        # the first column is the sample number
+        leads.extend(np.loadtxt(file, delimiter=',').T[1:])
+    return leads
+
+
+def synthetic_signals(n, duration=20, fs=360, seed=0, clean=False):
+    """
+    Generates n random ECGGenerator signals.
+
+    Returns
+    ----------
+    signals
+        List of 1D float arrays.
+    r_peaks
+        List of arrays of the R peak samples of each signal.
+    """
+    if GENERATOR_DIR not in sys.path:
+        sys.path.append(GENERATOR_DIR)
+
+    # NoiseGenerator reads the measured PSDs relative to the working directory, already when
+    # ecg_generator is imported
+    cwd = os.getcwd()
+    os.chdir(GENERATOR_DIR)
+    try:
+        import ecg_generator as eg
+        ecg = eg.ECGGenerator(fs=fs)
+        if clean:
+            ecg.noise_generator = None
+        signals, peak_labels, _, _, _, lengths = ecg.generate_batch(n, duration, seed=seed)
+    finally:
+        os.chdir(cwd)
+
+    signal_list, r_peaks = [], []
+    for signal, labels, length in zip(signals, peak_labels, lengths):
+        signal_list.append(signal[:length].astype(float))
+        # R peaks are labelled over 5 samples, the peak is the middle one
+        r_peak = np.concatenate(([False], labels[:length] == np.float32(0.6), [False]))
+        edges = np.flatnonzero(np.diff(r_peak.astype(int)))
+        r_peaks.append((edges[0::2] + edges[1::2] - 1) // 2)
+    return signal_list, r_peaks
+
+
+def match_peaks(detected, r_peaks, tolerance):
+    """
+    Matches every detection to the nearest unmatched R peak within tolerance (samples).
+    Returns the number of true positives.
+    """
+    r_peaks = np.sort(np.asarray(r_peaks))
+    matched = np.zeros(len(r_peaks), dtype=bool)
+    true_positives = 0
+    for peak in sorted(detected):
+        i = np.searchsorted(r_peaks, peak)
+        candidates = [j for j in (i-1, i) if 0 <= j < len(r_peaks) and not matched[j]
+                      and abs(r_peaks[j]-peak) <= tolerance]
+        if candidates:
+            j = min(candidates, key=lambda j: abs(r_peaks[j]-peak))
+            matched[j] = True
+            true_positives += 1
+    return true_positives
+
+
+def benchmark_detector(detector, signals, r_peaks=None, tolerance=0, memory_calls=5):
+    """
+    Runs one detector on every signal.
+
+    Returns
+    ----------
+    result
+        Dictionary of calls, errors, samples_per_second, latency_ms percentiles, peak_memory_bytes
+        and, if r_peaks is given, sensitivity and ppv. Calls that raise or return no list
+        count as errors and are left out of the other numbers.
+    """
+    latencies, samples, errors, succeeded = [], 0, {}, []
+    true_positives = n_detected = n_r_peaks = 0
+
+    for k, signal in enumerate(signals):
+        try:
+            # matched_filter_detector prints for frequencies without a template
+            with contextlib.redirect_stdout(io.StringIO()):
+                start = time.perf_counter()
+                detected = detector(signal)
+                latency = time.perf_counter() - start
+            if not isinstance(detected, list):
+                raise RuntimeError('detector returned %r' % (detected,))
+        except Exception as e:
+            message = '%s: %s' % (type(e).__name__, e)
+            errors[message] = errors.get(message, 0) + 1
+            continue
+
+        latencies.append(latency)
+        succeeded.append(signal)
+        samples += len(signal)
+        if r_peaks is not None:
+            true_positives += match_peaks(detected, r_peaks[k], tolerance)
+            n_detected += len(detected)
+            n_r_peaks += len(r_peaks[k])
+
+    # tracemalloc slows the calls down, so memory is measured in a separate pass
+    peak_memory = 0
+    tracemalloc.start()
+    try:
+        for signal in succeeded[:memory_calls]:
+            tracemalloc.reset_peak()
+            with contextlib.redirect_stdout(io.StringIO()):
+                detector(signal)
+            peak_memory = max(peak_memory, tracemalloc.get_traced_memory()[1])
+    finally:
+        tracemalloc.stop()
+
+    result = {'calls': len(signals), 'errors': sum(errors.values()), 'error_messages': errors}
+    if latencies:
+        latencies_ms = np.array(latencies)*1e3
+        result['samples_per_second'] = samples / sum(latencies)
+        result['latency_ms'] = {'mean': float(np.mean(latencies_ms)),
+                                **{'p%d' % q: float(np.percentile(latencies_ms, q)) for q in (50, 90, 99)},
+                                'max': float(np.max(latencies_ms))}
+        result['peak_memory_bytes'] = int(peak_memory)
+        if r_peaks is not None:
+            result['sensitivity'] = true_positives / n_r_peaks if n_r_peaks else None
+            result['ppv'] = true_positives / n_detected if n_detected else None
+    return result
+
+
+def run_benchmark(datasets, detectors=None, tolerance=0.1, memory_calls=5, log=print):
+    """
+    Runs every detector of detector_list (or the ones named in detectors) on every data set.
+
+    Parameters
+    ----------
+    datasets
+        Dictionary of name: (signals, r_peaks or None, fs).
+    tolerance
+        Largest distance in seconds between a detection and an R peak to count as found.
+
+    Returns
+    ----------
+    results
+        List of result dictionaries with 'dataset', 'fs' and 'detector' keys.
+    """
+    results = []
+    for name, (signals, r_peaks, fs) in datasets.items():
+        for description, detector in Detectors(fs).detector_list:
+            if detectors and description not in detectors:
+                continue
+            result = benchmark_detector(detector, signals, r_peaks, tolerance*fs, memory_calls)
+            results.append({'dataset': name, 'fs': fs, 'detector': description, **result})
+            log(_summary(results[-1]))
+    return results
+
+
+def detector_peaks(leads, fs, detectors=None):
+    """
+    Runs every detector of detector_list (or the ones named in detectors) on every lead.
+
+    Returns
+    ----------
+    peaks
+        Dictionary of detector description: list of the detected peaks of each lead,
+        or {'error': exception type name} for leads where the detector raises.
+    """
+    peaks = {}
+    for description, detector in Detectors(fs).detector_list:
+        if detectors and description not in detectors:
+            continue
+        peaks[description] = []
+        for lead in leads:
+            try:
+                with contextlib.redirect_stdout(io.StringIO()):
+                    peaks[description].append([int(peak) for peak in detector(lead)])
+            except Exception as e:
+                peaks[description].append({'error': type(e).__name__})
+    return peaks
+
+
+def library_versions():
+    """
+    numpy and scipy versions, stored with the peaks: the thresholds of some detectors compare
+    values that tie, so the peaks can depend on how the library versions round.
+    """
+    return {'numpy': np.__version__, 'scipy': scipy.__version__}
+
+
+def _same_peaks(a, b):
+    # None is left by files stored before the error type was kept, it never matches
+    return a is not None and b is not None and a == b
+
+
+def compare_peaks(stored, peaks):
+    """
+    Compares detected peaks to stored ones (both as returned by detector_peaks).
+    Only the detectors and leads present in both are compared. A lead where the detector
+    raises matches only a stored error of the same type, a None on either side never matches.
+
+    Returns
+    ----------
+    mismatches
+        Dictionary of detector description: indices of the leads whose peaks differ.
+    """
+    mismatches = {}
+    for description in stored.keys() & peaks.keys():
+        different = [i for i, (a, b) in enumerate(zip(stored[description], peaks[description])) if not _same_peaks(a, b)]
+        if different:
+            mismatches[description] = different
+    return mismatches
+
+
+def _summary(result):
+    line = '%-10s %-36s' % (result['dataset'], result['detector'])
+    if 'samples_per_second' in result:
+        line += ' %12.0f samples/s  p50 %8.2f ms  p99 %8.2f ms  %8.1f kB' % (
+            result['samples_per_second'], result['latency_ms']['p50'], result['latency_ms']['p99'],
+            result['peak_memory_bytes']/1e3)
+        if result.get('sensitivity') is not None:
+            line += '  Se %.3f  PPV %.3f' % (result['sensitivity'], result['ppv'] or 0)
+    if result['errors']:
+        line += '  %d/%d errors' % (result['errors'], result['calls'])
+    return line
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Speed, memory and accuracy benchmark of the beat detectors.')
+    parser.add_argument('--records', type=int, default=None, help='number of set-a recordings, default: all')
+    parser.add_argument('--synthetic', type=int, default=100, help='number of synthetic signals')
+    parser.add_argument('--duration', type=float, default=20, help='duration of the synthetic signals in seconds')
+    parser.add_argument('--fs', type=int, default=360, help='sampling frequency of the synthetic signals')
+    parser.add_argument('--clean', action='store_true', help='synthetic signals without noise')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--tolerance', type=float, default=0.1, help='R peak tolerance in seconds')
+    parser.add_argument('--memory-calls', type=int, default=5, help='calls per detector traced for peak memory')
+    parser.add_argument('--detector', action='append', help='description in detector_list, default: all')
+    parser.add_argument('--out', help='output file, default: saved_data/detector_benchmark.json')
+    parser.add_argument('--store-peaks', metavar='FILE', help='store the detected peaks on the set-a leads and exit')
+    parser.add_argument('--check-peaks', metavar='FILE', help='compare the detected peaks on the set-a leads '
+                        'to the stored ones and exit, with status 1 on a mismatch')
+    args = parser.parse_args(argv)
+
+    if args.store_peaks or args.check_peaks:
+        leads = load_set_a(args.records)
+        peaks = detector_peaks(leads, 500, args.detector)
+        if args.store_peaks:
+            with open(args.store_peaks, 'w') as f:
+                json.dump({'records': args.records, 'fs': 500, **library_versions(), 'peaks': peaks}, f)
+            return 0
+        with open(args.check_peaks) as f:
+            stored = json.load(f)
+        if stored['records'] != args.records:
+            parser.error('%s holds the peaks of --records %s' % (args.check_peaks, stored['records']))
+        if {key: stored.get(key) for key in library_versions()} != library_versions():
+            print('%s was stored with numpy %s and scipy %s, ties in the thresholds can resolve differently'
+                  % (args.check_peaks, stored.get('numpy'), stored.get('scipy')))
+        mismatches = compare_peaks(stored['peaks'], peaks)
+        for description in sorted(peaks):
+            different = mismatches.get(description, [])
+            print('%-36s %s' % (description, '%d/%d leads differ' % (len(different), len(leads))
+                                if different else 'ok'))
+        return 1 if mismatches else 0
+
+    datasets = {}
+    if args.records != 0:
+        datasets['set-a'] = (load_set_a(args.records), None, 500)
+    if args.synthetic:
+        signals, r_peaks = synthetic_signals(args.synthetic, args.duration, args.fs, args.seed, args.clean)
+        datasets['synthetic'] = (signals, r_peaks, args.fs)
+
+    results = run_benchmark(datasets, args.detector, args.tolerance, args.memory_calls)
+
+    out = args.out or os.path.join(PROJECT_DIR, 'saved_data', 'detector_benchmark.json')
+    with open(out, 'w') as f:
+        json.dump({'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                   'python': platform.python_version(), **library_versions(),
+                   'platform': platform.platform(), 'arguments': vars(args),
+                   'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
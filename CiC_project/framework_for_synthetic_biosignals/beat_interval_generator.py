@@ -28,6 +28,8 @@ class BeatIntervalGenerator():
     step_prob: float = 0.5
     step_min: float = 0.3
     step_max: float = 2
+    # beats of long-term correlation history kept by stream(), see _stochastic()
+    history: int = 100000
 
     def generate(self):
         """
@@ -39,31 +41,80 @@ class BeatIntervalGenerator():
         """
 
         if self.beat_intervals is None:
-            breathing_gen = lambda bf, bc, br_prev: bc*np.sin(2*np.pi*br_prev*bf)
-            y = self._stochastic(self.n, self.a, self.std, self.b)    
-        
-            z = np.zeros(self.n)
-            if self.step:       
-                z = self._gen_hr_step()
-            intervals = np.zeros(self.n)
-            for i in np.arange(self.n):  
-                br_prev = np.sum(intervals)
-                intervals[i] = self.mu*(1+z[i]) + breathing_gen(self.bf, self.bc, br_prev) + y[i]   
-                # scales the effect of breathing for rr intervals < 0.35 to avoid negative values 
-                if intervals[i] < 0.35:
-                    intervals[i] = self.mu*(1+z[i]) * (1 + breathing_gen(self.bf, self.bc, br_prev))
-
+            intervals = self._generate_block(self._new_state())
         else:
             intervals = np.array(self.beat_intervals)
 
+        return intervals
+
+    def stream(self):
+        """
+        Generates consecutive blocks of n beat intervals of one continuous recording.
+        The heart rate step is applied once, and the breathing phase and the long-term correlation
+        continue over block boundaries. The first block equals the output of generate().
+        Yields
+        ----------
+        intervals
+            Generated beat intervals.
+        """
+
+        state = self._new_state()
+        while True:
+            if self.beat_intervals is None:
+                yield self._generate_block(state)
+            else:
+                yield np.array(self.beat_intervals)
+
+    def _new_state(self) -> dict:
+        """
+        Returns the state of an empty recording for _generate_block().
+        beat: number of generated beats, time: sum of generated intervals, 
+        sq_cumsum, sq_start, sq_used, level, span_ends and span_values: long-term correlation state of _stochastic().
+        """
+
+        return {'beat': 0, 'time': 0.0, 'sq_cumsum': np.zeros(1), 'sq_start': 0, 'sq_used': 1, 'level': 0.0, 
+                'span_ends': np.zeros(0, dtype=int), 'span_values': np.zeros(0)}
 
+    def _generate_block(self, state: dict) -> np.ndarray:
+        """
+        Generates the next n beat intervals of the recording and updates state.
 
+        Parameters
+        ----------
+        state
+            Recording state from _new_state()
+        Returns
+        ----------
+        intervals
+            Generated beat intervals.
+        """
+
+        breathing_gen = lambda bf, bc, br_prev: bc*np.sin(2*np.pi*br_prev*bf)
+        y = self._stochastic(self.n, self.a, self.std, self.b, state)    
+    
+        z = np.zeros(self.n)
+        if self.step:       
+            z = self._gen_hr_step(state['beat'])
+        intervals = np.zeros(self.n)
+        for i in np.arange(self.n):  
+            br_prev = state['time'] + np.sum(intervals)
+            intervals[i] = self.mu*(1+z[i]) + breathing_gen(self.bf, self.bc, br_prev) + y[i]   
+            # scales the effect of breathing for rr intervals < 0.35 to avoid negative values 
+            if intervals[i] < 0.35:
+                intervals[i] = self.mu*(1+z[i]) * (1 + breathing_gen(self.bf, self.bc, br_prev))
+
+        state['beat'] += self.n
+        state['time'] += np.sum(intervals)
         return intervals
     
-    def _gen_hr_step(self) -> np.ndarray:
+    def _gen_hr_step(self, offset: int = 0) -> np.ndarray:
         """
         Generates the change in the heart rate.
         
+        Parameters
+        ----------
+        offset
+            Number of beats generated before, the step happens only in the first block
         Returns
         ----------
         z
@@ -73,13 +124,13 @@ class BeatIntervalGenerator():
 
         tau_constant = 3
         distance = self.step_i*self.n
-        x = np.linspace(1, self.n, self.n)
+        x = np.linspace(1, self.n, self.n) + offset
         z = ((self.mu_new/self.mu)-1)/(1 + np.exp(-(x-distance)/self.step_f*tau_constant))
         
         return z
 
 
-    def _stochastic(self, n: int, a: float, std: float, b: float) -> np.ndarray:
+    def _stochastic(self, n: int, a: float, std: float, b: float, state: dict = None) -> np.ndarray:
         """
         Generates long-term correlation. Source: Citation J. W. Kantelhardt et al 2003 EPL 62 147
         
@@ -93,24 +144,55 @@ class BeatIntervalGenerator():
             Standard deviation
         b
             Coefficient
+        state
+            Recording state from _new_state(), continued and updated in place. 
+            It keeps the last self.history beats: the window of eq. 3 is Pareto distributed and a window 
+            reaching further back is shortened to them, so the state and the time per beat stay bounded. 
+            The result equals the unbounded sum while no window reaches back more than self.history beats 
+            (chance about (6/history)**a per beat).
         Returns
         ----------
         Beat intervals with transient correlations
 
         """
+        if state is None:
+            state = self._new_state()
         k, x = self._rand_sequence(n, a, std)    
-        y, y_tmp = np.zeros(n), np.zeros(n)
-        for i in np.arange(n):       
+        y_tmp = np.zeros(n)
+        # Prefix sums of y_tmp**2 give the windowed mean of eq. 3 in constant time.
+        # sq_cumsum[m] is the sum over the beats before beat sq_start + m, the first sq_used values are set.
+        sq_cumsum, start, used = state['sq_cumsum'], state['sq_start'], state['sq_used']
+        if used + n > len(sq_cumsum):
+            # keep the last history beats, with room for the next blocks so that this copy is rare
+            drop = max(0, used - 1 - self.history)
+            kept = sq_cumsum[drop:used]
+            sq_cumsum = np.zeros(max(2*len(kept), len(kept) + n))
+            sq_cumsum[:len(kept)] = kept
+            start, used = start + drop, len(kept)
+        i0 = start + used - 1
+        for i in range(n):       
             #eq. 3          
-            if i - k[i] > 0:
-                avg = np.mean(np.square(y_tmp[i-k[i]:i])) 
+            g = i0 + i
+            if g - k[i] > 0:
+                lo = max(g - k[i], start)
+                avg = (sq_cumsum[g-start] - sq_cumsum[lo-start])/(g-lo)
                 y_tmp[i] = x[i]*np.sqrt(1+b*avg)            
-            else: 
-                y_tmp[i] = 0   
-                
-            m = np.zeros(i)
-            m[(k[:i] + np.arange(i) - i) > 0] = 1
-            y[i] = 0.05*np.sum(y_tmp[:i]*m)
+            sq_cumsum[g-start+1] = sq_cumsum[g-start] + y_tmp[i]**2
+
+        # y_tmp[j] contributes to y[i] for j < i < j + k[j], summed with a difference array over the block.
+        # Spans ending beyond this block are carried to the next one in state['span_ends'] and state['span_values'],
+        # relative to the next block, and the sum of the spans covering the block start in state['level'].
+        ends = np.concatenate((state['span_ends'], np.arange(n) + k))
+        values = np.concatenate((state['span_values'], y_tmp))
+        in_block = ends <= n
+        diff = np.zeros(n + 1)
+        diff[0] = state['level']
+        diff[1:] += y_tmp
+        np.add.at(diff, ends[in_block], -values[in_block])
+        level = np.cumsum(diff)
+        y = 0.05*level[:n]
+        state['sq_cumsum'], state['sq_start'], state['sq_used'], state['level'] = sq_cumsum, start, used + n, level[n]
+        state['span_ends'], state['span_values'] = ends[~in_block] - n, values[~in_block]
         return y
     
     def _rand_sequence(self, n: int, a: float, std: float) -> tuple[np.ndarray, np.ndarray]:
@@ -1,5 +1,6 @@
 from dataclasses import dataclass
 import numpy as np
+from scipy import integrate
 from signal_generator import SignalGenerator
 from noise_generator import NoiseGenerator
 from beat_interval_generator import BeatIntervalGenerator
@@ -81,24 +82,144 @@ class ECGGenerator(SignalGenerator):
         beat_intervals = self.beat_interval_generator.generate()
         signal, beat_intervals = super().generate(beat_intervals, self.fs)
 
+        peak_labels = self._peak_labels(beat_intervals, len(signal))
+        
+        if self.noise_generator is not None:
+            signal, peak_labels, labels = self.noise_generator.combine_signal_noise(signal, noise_signal, peak_labels, labels)  
+
+
+        return signal, peak_labels, labels, beat_intervals/self.fs
+    
+    
+    def generate_stream(self, chunk_size, n_chunks=None):
+        """
+        Generates a clean or noisy ECG signal in chunks, for arbitrarily long recordings in bounded memory.
+        Beat intervals and noise segments are generated on demand and the integration continues over chunk boundaries.
+        The beat intervals come from beat_interval_generator.stream(), so a heart rate step happens once
+        and the breathing and long-term correlation of the intervals continue over the blocks of beats.
+        With noise_generator.artifact_bool, the artifact position (artifact_start, artifact_idx) is drawn 
+        from artifact_start_rng and artifact_idx_rng for every noise segment.
+        The signal is normalized with the minimum and maximum of the first block of beats,
+        so later values can slightly exceed the range [0, 1].
+        
+        Parameters
+        ----------
+        chunk_size
+            Number of samples in each chunk.
+        n_chunks
+            Number of chunks to generate. If None, chunks are generated indefinitely.
+        Yields
+        ----------
+        signal
+            Chunk of clean or noisy ECG signal.
+        peak_labels
+            1D array of labels for P, R and T waves.
+        noise_labels
+            Amplitude of the noise at each sample (zeros without noise_generator).
+        artifact_labels
+            Amplitude of the artifact at each sample.
+        """
+        self.distance = self.ecg_distance.to_list()
+        self.width = self.ecg_width.to_list()
+        self.amplitude = self.ecg_amplitude.to_list()
+        self.symmetry = self.ecg_symmetry.to_list()
+        self.beat_interval_generator.n = self.number_of_beats
+        tap_len = 20
+        intervals = self.beat_interval_generator.stream()
+
+        signal, peak_labels = np.zeros(0), np.zeros(0)
+        noise, noise_labels, artifact_labels = np.zeros(0), np.zeros(0), np.zeros(0)
+        # Integration state: last derivative and signal value, and the normalization range.
+        der_last, synt_last, synt_range = None, 0.0, None
+        chunk = 0
+        while n_chunks is None or chunk < n_chunks:
+            while len(signal) < chunk_size:
+                der, beat_intervals = self._derivative(next(intervals), self.fs)
+                if der_last is None:
+                    synt = integrate.cumtrapz(der, dx=1/self.fs, initial=0)
+                    synt_range = (np.nanmin(synt), np.nanmax(synt))
+                else:
+                    synt = integrate.cumtrapz(np.concatenate(([der_last], der)), dx=1/self.fs, initial=0)[1:] + synt_last
+                der_last, synt_last = der[-1], synt[-1]
+                synt = (synt - synt_range[0]) / (synt_range[1] - synt_range[0])
+                signal = np.concatenate((signal, synt))
+                peak_labels = np.concatenate((peak_labels, self._peak_labels(beat_intervals, len(synt))))
+
+            if self.noise_generator is not None:
+                self.noise_generator.fs = self.fs
+                # Keep tap_len samples in the buffer so that the next segment can be tapered to it.
+                while len(noise) < chunk_size + tap_len:
+                    segment, labels = self._generate_noise_segment()
+                    segment_labels = np.concatenate(list(zip(*labels[:-1]))[1])
+                    if len(noise) < tap_len:
+                        noise = np.concatenate((noise, segment))
+                        noise_labels = np.concatenate((noise_labels, segment_labels))
+                        artifact_labels = np.concatenate((artifact_labels, labels[-1][1]))
+                    else:
+                        cut = len(noise) - tap_len // 2
+                        noise, _ = self.noise_generator._concatenate_two_time_realisations(noise, segment, tap_len)
+                        noise_labels = np.concatenate((noise_labels[:cut], segment_labels[tap_len - tap_len // 2:]))
+                        artifact_labels = np.concatenate((artifact_labels[:cut], labels[-1][1][tap_len - tap_len // 2:]))
+            else:
+                noise = noise_labels = artifact_labels = np.zeros(chunk_size)
+
+            yield (signal[:chunk_size] + noise[:chunk_size], peak_labels[:chunk_size], 
+                   noise_labels[:chunk_size], artifact_labels[:chunk_size])
+
+            signal, peak_labels = signal[chunk_size:], peak_labels[chunk_size:]
+            noise, noise_labels, artifact_labels = noise[chunk_size:], noise_labels[chunk_size:], artifact_labels[chunk_size:]
+            chunk += 1
+
+    def _generate_noise_segment(self):
+        """
+        Generates a noise segment for generate_stream(). The artifact position is drawn for every segment,
+        so that the artifact does not repeat at the same place; the caller's values are restored afterwards.
+        
+        Returns
+        ----------
+        segment
+            Noise segment.
+        labels
+            Noise labels as returned by noise_generator.generate().
+        """
+        ng = self.noise_generator
+        if not ng.artifact_bool:
+            return ng.generate()
+        artifact_start, artifact_idx = ng.artifact_start, ng.artifact_idx
+        ng.artifact_start = np.random.uniform(ng.artifact_start_rng[0], ng.artifact_start_rng[1])
+        ng.artifact_idx = np.random.uniform(ng.artifact_idx_rng[0], ng.artifact_idx_rng[1])
+        try:
+            return ng.generate()
+        finally:
+            ng.artifact_start, ng.artifact_idx = artifact_start, artifact_idx
+
+    def _peak_labels(self, beat_intervals, length):
+        """
+        Creates labels for P and T waves and R peaks.
+        
+        Parameters
+        ----------
+        beat_intervals
+            Beat intervals in samples.
+        length
+            Length of the signal.
+        Returns
+        ----------
+        peak_labels
+            1D array of labels for P, R and T waves.
+        """
         # Find R peaks.
-        r_peaks = np.zeros(len(beat_intervals), dtype=int)
-        for i, nn in enumerate(beat_intervals):
-            r_peaks[i] = nn // 2 if i == 0 else nn // 2 + np.sum(beat_intervals[:i])
+        r_peaks = beat_intervals // 2
+        r_peaks[1:] += np.cumsum(beat_intervals)[:-1]
         
         p_waves = r_peaks + np.array(self.ecg_distance.p*beat_intervals, dtype=int)
         t_waves = r_peaks + np.array(self.ecg_distance.t*beat_intervals, dtype=int)
-        peak_labels = np.zeros(len(signal))
+        peak_labels = np.zeros(length)
         peak_labels = create_label(peak_labels, p_waves, 0.2)
         peak_labels = create_label(peak_labels, r_peaks, 0.6)
         peak_labels = create_label(peak_labels, t_waves, 0.4)
-        
-        if self.noise_generator is not None:
-            signal, peak_labels, labels = self.noise_generator.combine_signal_noise(signal, noise_signal, peak_labels, labels)  
 
-
-        return signal, peak_labels, labels, beat_intervals/self.fs
-    
+        return peak_labels
     
     def generate_random_set(self, number_of_signals, duration):
         """
@@ -124,16 +245,7 @@ class ECGGenerator(SignalGenerator):
         signals, peak_inds, labels, beats_list = [], [], [], []
         self.number_of_beats = duration
         for _ in range(number_of_signals):
-            self.beat_interval_generator.beat_intervals = None
-            self.ecg_distance = self._randomize_prms(self.ecg_distance_low, self.ecg_distance_high)
-            self.ecg_width = self._randomize_prms(self.ecg_width_low, self.ecg_width_high)
-            self.ecg_amplitude = self._randomize_prms(self.ecg_amplitude_low, self.ecg_amplitude_high)
-            self.ecg_symmetry = self._randomize_prms(self.ecg_symmetry_low, self.ecg_symmetry_high)
-            self.beat_interval_generator.randomize()
-            
-            if self.noise_generator is not None:
-                self.noise_generator.randomize()
-            
+            self._randomize()
             signal, r_peaks, label, beats = self.generate()
             signals.append(signal)
             peak_inds.append(r_peaks)
@@ -143,6 +255,113 @@ class ECGGenerator(SignalGenerator):
         return signals, peak_inds, labels, beats_list
 
     
+    def generate_batch(self, n, duration, seed=None):
+        """
+        Generates a batch of random ECG signals into preallocated 2D arrays.
+        Beat intervals and noise are generated to cover the duration. Only with a noise_list,
+        whose durations are kept, rows can be shorter (padded with nan, and 0 in peak_labels).
+        number_of_beats, the noise type and its duration, beat_interval_generator.n and 
+        beat_interval_generator.beat_intervals are restored afterwards.
+        
+        Parameters
+        ----------
+        n
+            Number of generated signals.
+        duration
+            Duration of each signal in seconds.
+        seed
+            Seed for the random number generators, their state is restored afterwards. If None, the current state is used.
+        Returns
+        ----------
+        signals
+            Float32 array of shape (n, duration*fs) of clean or noisy ECG signals.
+        peak_labels
+            Float32 array of shape (n, duration*fs) of labels for P, R and T waves.
+        labels
+            List of noise labels of each signal, as in generate_random_set().
+        beat_intervals
+            Beat intervals of all signals concatenated, in seconds.
+        beat_offsets
+            Array of n+1 offsets, beat intervals of signal i are beat_intervals[beat_offsets[i]:beat_offsets[i+1]].
+        lengths
+            Number of valid samples in each row of signals.
+        """
+        n_samples = int(duration*self.fs)
+        signals = np.full((n, n_samples), np.nan, dtype=np.float32)
+        peak_labels = np.zeros((n, n_samples), dtype=np.float32)
+        lengths = np.zeros(n, dtype=int)
+        beat_offsets = np.zeros(n + 1, dtype=int)
+        labels, beats_list = [], []
+
+        # restored after the batch
+        number_of_beats = self.number_of_beats
+        beats_n = self.beat_interval_generator.n
+        fixed_intervals = self.beat_interval_generator.beat_intervals
+        if self.noise_generator is not None:
+            noise_type = self.noise_generator.noise_type
+            noise_duration = noise_type.duration
+        if seed is not None:
+            np_state, random_state = np.random.get_state(), random.getstate()
+            np.random.seed(seed)
+            random.seed(seed)
+
+        try:
+            for i in range(n):
+                self._randomize()
+                self.number_of_beats = int(duration/self.beat_interval_generator.mu*1.1)
+
+                # Beat intervals are drawn until they cover the duration, so that the row is filled.
+                self.beat_interval_generator.n = self.number_of_beats
+                intervals = self.beat_interval_generator.stream()
+                beats = next(intervals)
+                while np.sum(np.array(beats*self.fs, dtype=int)) < n_samples:
+                    beats = np.concatenate((beats, next(intervals)))
+                self.beat_interval_generator.beat_intervals = beats
+
+                # Noise from a PSD is a few samples shorter than its duration, it is made long enough for the row.
+                # With a noise_list, noise_type is its last item after generate(), so only a lone noise_type is changed.
+                if self.noise_generator is not None:
+                    self.noise_generator.fs = self.fs
+                    if not self.noise_generator.noise_list:
+                        self.noise_generator.noise_type.duration = self.noise_generator.duration_for(n_samples)
+                signal, r_peaks, label, beats = self.generate()
+
+                label = [(noise, values[:n_samples]) for noise, values in label]
+                lengths[i] = min(len(signal), n_samples)
+                signals[i, :lengths[i]] = signal[:lengths[i]]
+                peak_labels[i, :lengths[i]] = r_peaks[:lengths[i]]
+                labels.append(label)
+                beats_list.append(beats)
+                beat_offsets[i+1] = beat_offsets[i] + len(beats)
+        finally:
+            self.number_of_beats = number_of_beats
+            self.beat_interval_generator.n = beats_n
+            self.beat_interval_generator.beat_intervals = fixed_intervals
+            if self.noise_generator is not None:
+                self.noise_generator.noise_type = noise_type
+                noise_type.duration = noise_duration
+            if seed is not None:
+                np.random.set_state(np_state)
+                random.setstate(random_state)
+
+        beat_intervals = np.concatenate(beats_list) if beats_list else np.zeros(0)
+
+        return signals, peak_labels, labels, beat_intervals, beat_offsets, lengths
+
+    def _randomize(self):
+        """
+        Randomizes waveform, beat interval and noise parameters for a new random signal.
+        """
+        self.beat_interval_generator.beat_intervals = None
+        self.ecg_distance = self._randomize_prms(self.ecg_distance_low, self.ecg_distance_high)
+        self.ecg_width = self._randomize_prms(self.ecg_width_low, self.ecg_width_high)
+        self.ecg_amplitude = self._randomize_prms(self.ecg_amplitude_low, self.ecg_amplitude_high)
+        self.ecg_symmetry = self._randomize_prms(self.ecg_symmetry_low, self.ecg_symmetry_high)
+        self.beat_interval_generator.randomize()
+        
+        if self.noise_generator is not None:
+            self.noise_generator.randomize()
+
     def _randomize_prms(self, low_prms: ECGWavePrms, 
                           high_prms: ECGWavePrms) -> np.ndarray:
         """
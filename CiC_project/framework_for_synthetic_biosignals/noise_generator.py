@@ -1,3 +1,6 @@
+import os
+import threading
+from collections import OrderedDict
 import numpy as np
 from utils import interpolate_, min_max_normalize, zero_mean, find_corresponding
 from dataclasses import dataclass, field
@@ -7,6 +10,104 @@ from wfdb import rdsamp
 import matplotlib.pyplot as plt
 from utils import default_field
 
+# Process-wide registry of measured PSDs and artifact records shared by all NoiseGenerators.
+# The arrays are read-only, call invalidate_noise_registry() when the underlying files change.
+_noise_registry = {}
+_noise_registry_lock = threading.Lock()
+
+def get_registered_noise(key: tuple, loader) -> np.ndarray:
+    """
+    Returns the registered array for key, loading it with loader() on first use.
+
+    Parameters
+    ----------
+    key
+        Registry key, e.g. ('psd', path) or ('artifact', record, fs, ...)
+    loader
+        Function without arguments returning the array
+
+    Returns
+    ----------
+    arr
+        Read-only shared array
+    """
+    with _noise_registry_lock:
+        if key not in _noise_registry:
+            arr = np.asarray(loader())
+            arr.flags.writeable = False
+            _noise_registry[key] = arr
+        return _noise_registry[key]
+
+def invalidate_noise_registry(kind: str = None):
+    """
+    Drops registered arrays so that they are reloaded on next use, also by existing NoiseGenerators
+    as they look the arrays up in the registry whenever they need them.
+
+    Parameters
+    ----------
+    kind
+        'psd' or 'artifact' to drop only that kind of entries, None drops everything
+    """
+    with _noise_registry_lock:
+        for key in list(_noise_registry):
+            if kind is None or key[0] == kind:
+                del _noise_registry[key]
+        # Synthesis plans are derived from the measured PSDs
+        if kind is None or kind == 'psd':
+            _synthesis_plans.clear()
+
+# Synthesis plans of the most recently used noise types, see NoiseGenerator._get_synthesis_plan()
+_synthesis_plans = OrderedDict()
+_max_synthesis_plans = 256
+
+@dataclass
+class SynthesisPlan:
+    """
+    Precomputed part of the PSD to time realisation of one noise type: the magnitude envelope of 
+    the interpolated PSD and the linear interpolation from the realisation grid to the output grid.
+    Only the random spectrum and one inverse rFFT are computed per realisation.
+    """
+    magnitude: np.ndarray
+    n_fft: int
+    scale: float
+    normalize: bool
+    lo_idx: np.ndarray
+    weight: np.ndarray
+
+    def realise(self, amplitude: float, n: int = None) -> np.ndarray:
+        """
+        Creates time realisations from the plan.
+
+        Parameters
+        ----------
+        amplitude
+            Amplitude of the noise
+        n
+            Number of realisations. If None, a single 1D realisation is returned.
+
+        Returns
+        ----------
+        y
+            The generated time realisation, or array of shape (n, samples) of realisations
+        """
+        size = 1 if n is None else n
+        n_freq = len(self.magnitude)
+        x = np.random.randn(size, n_freq) + 1j*np.random.randn(size, n_freq)
+        w = np.zeros((size, n_freq + 1), dtype=complex)
+        w[:, 1:] = self.magnitude*x
+
+        # The spectrum is Hermitian, so the inverse rFFT equals the real part of the full inverse FFT
+        y = self.scale*np.fft.irfft(w, n=self.n_fft, axis=-1)[:, 1:]
+        if self.normalize:
+            y = y/np.std(y, axis=-1, keepdims=True)
+        y = y*amplitude
+
+        # Linear interpolation to the output sampling grid
+        y_lo = y[:, self.lo_idx]
+        y = y_lo + self.weight*(y[:, self.lo_idx + 1] - y_lo)
+
+        return y[0] if n is None else y
+
 @dataclass
 class NoiseType:
     name: str = 'model'
@@ -50,7 +151,6 @@ class NoiseGenerator():
                             'muscle_artifact', 'baseline_wander'])          
     fs: int = 200
     noise_list: list[NoiseType] = default_field([])
-    noise_psds = {}
     amplitude_rng: list[float] = default_field([0.005, 0.25])
     noise_type: NoiseType = default_field(NoiseType())
     alpha_rng: list = default_field([0, 5])
@@ -72,12 +172,16 @@ class NoiseGenerator():
     artifact_length_rng: list = default_field([1, 10])
     artifact_idx: float = 0.5
     artifact_idx_rng: list = default_field([0, 1])
-    __artifact_arrs = None
+    # ecg_generator creates a NoiseGenerator on import, so the defaults are read from the environment
+    artifact_cache_dir: str = field(default_factory=lambda: os.environ.get('NSTDB_CACHE_DIR'))
+    nstdb_dir: str = field(default_factory=lambda: os.environ.get('NSTDB_DIR'))
 
     def __post_init__(self):
-        self.__artifact_arrs = (self._load_noise())
+        # The artifact records are loaded on the first _add_artifact, at the fs of that call
+        # The measured PSDs are read relative to the working directory at construction
+        self._measurement_dir = os.path.abspath('./measurements')
         for nt in self.available_noise_types:
-                self.noise_psds[nt] = np.loadtxt(f'./measurements/{nt}.csv', delimiter=',')
+                self._noise_psd(nt)
     
     def generate(self):
         """
@@ -103,22 +207,9 @@ class NoiseGenerator():
                 if item.name != 'model':
                     raise ValueError("'%s' is not a valid noise type." % item.name)
 
-            if item.name == 'model':
-                psd, freq = self._model_psd()
-            else:
-                psd = self.noise_psds[item.name][0]
-                freq = self.noise_psds[item.name][1]
-
-            if item.point_bool:
-                psd, freq = self._add_point_frequency(psd, freq, empty)
-                
-            time, y = self._get_time_realisation(psd, freq)
-            new_fs = self.fs
-            new_time = np.linspace(0, (len(time)*(new_fs/(freq[-1]*2)))/new_fs, int((len(time))*(new_fs/(freq[-1]*2))))
-            y, time = interpolate_(time, new_time, y, fill_value='extrapolate')
+            y = self._get_synthesis_plan(empty).realise(item.amplitude)
             label = self.noise_type._get_label(fs=self.fs)
             label = (label, item.amplitude)
-            y = y[:item.duration*self.fs]
             noises.append(y)
             noise_labels.append(label)
 
@@ -164,70 +255,156 @@ class NoiseGenerator():
           self.artifact_idx = x(self.artifact_idx_rng[0], self.artifact_idx_rng[1])
           self.artifact_amp = x(self.artifact_amp_rng[0], self.artifact_amp_rng[1])
         
-    def _get_time_realisation(self, psd: np.ndarray, freq: np.ndarray) -> tuple[np.ndarray, np.ndarray]: 
+    def generate_realisations(self, n: int) -> np.ndarray:
         """
-        Interpolates psd and freq and creates the time realisation of given duration (in secs) from the psd.
+        Generates n time realisations of the current noise_type at once, without artifacts.
 
         Parameters
         ----------
-        psd
-            PSD of the noise
-        freq
-            Frequency vector of the PSD
+        n
+            Number of realisations
 
         Returns
         ----------
-        time
-            Time vector of the signal
-        y   
-            The generated time realisation
+        y
+            Array of shape (n, samples) of time realisations
         """
-        new_freq = np.linspace(freq[0], freq[-1], int(self.noise_type.duration*freq[-1]), endpoint=True)
-        psd, freq = interpolate_(freq, new_freq, psd, fill_value='extrapolate')
-        time, y = self._psd2time(freq, psd)
-        if self.noise_type.name != 'model':
-            y = y/np.std(y)
-        y = y*self.noise_type.amplitude
-            
-        return time, y
-
-    def _psd2time(self, freq: np.ndarray, psd: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        if self.noise_type.name not in self.available_noise_types and self.noise_type.name != 'model':
+            raise ValueError("'%s' is not a valid noise type." % self.noise_type.name)
+
+        return self._get_synthesis_plan(empty=True).realise(self.noise_type.amplitude, n)
+
+    def duration_for(self, n_samples: int) -> float:
+        """
+        Returns the noise_type duration (in secs) whose noise has at least n_samples samples at fs.
+        Noise from a PSD is up to two frequency bins of the PSD and one sample shorter than its duration.
+
+        Parameters
+        ----------
+        n_samples
+            Number of samples needed
+
+        Returns
+        ----------
+        duration
+            Duration of the noise
+        """
+        if self.noise_type.name == 'model':
+            nyquist = self.fs/2
+        else:
+            nyquist = self._noise_psd(self.noise_type.name)[1][1][-1]
+
+        return n_samples/self.fs + 2/nyquist + 2/self.fs
+
+    def _get_synthesis_plan(self, empty: bool) -> SynthesisPlan:
+        """
+        Returns the synthesis plan of the current noise_type. Plans are cached by noise type, duration and fs,
+        and by the model and point frequency parameters when they are used.
+
+        Parameters
+        ----------
+        empty
+            True, if noise_list was empty
+
+        Returns
+        ----------
+        plan
+            Synthesis plan of the noise
+        """
+        item = self.noise_type
+        key = (item.name, item.duration, self.fs)
+        if item.name == 'model':
+            key += (item.alpha, item.c, item.wn)
+        if item.point_bool:
+            key += (item.point_freq, item.point_value)
+        # Registry key of the measured PSD, the plans are dropped with it in invalidate_noise_registry()
+        if item.name != 'model':
+            psd_key, measured_psd = self._noise_psd(item.name)
+            key += psd_key
+
+        with _noise_registry_lock:
+            plan = _synthesis_plans.get(key)
+            if plan is not None:
+                _synthesis_plans.move_to_end(key)
+                return plan
+
+        if item.name == 'model':
+            psd, freq = self._model_psd()
+        else:
+            psd = measured_psd[0]
+            freq = measured_psd[1]
+
+        if item.point_bool:
+            psd, freq = self._add_point_frequency(psd, freq, empty)
+
+        plan = self._make_synthesis_plan(psd, freq)
+        with _noise_registry_lock:
+            _synthesis_plans[key] = plan
+            if len(_synthesis_plans) > _max_synthesis_plans:
+                _synthesis_plans.popitem(last=False)
+
+        return plan
+
+    def _noise_psd(self, name: str) -> tuple[tuple, np.ndarray]:
         """
-        Creates time realisation from the psd. Last value of the freq vector is the Nyquist frequency. 
+        Returns the measured PSD of a noise type from the registry, loading it from the measurements on first use.
 
         Parameters
         ----------
+        name
+            Noise type, one of available_noise_types
+
+        Returns
+        ----------
+        key
+            Registry key of the PSD
+        psd
+            Array of the PSD (row 0) and its frequency vector (row 1)
+        """
+        path = os.path.join(self._measurement_dir, f'{name}.csv')
+        key = ('psd', path)
+        return key, get_registered_noise(key, lambda: np.loadtxt(path, delimiter=','))
+
+    def _make_synthesis_plan(self, psd: np.ndarray, freq: np.ndarray) -> SynthesisPlan:
+        """
+        Interpolates psd and freq to given duration (in secs) and precomputes the time realisation from the psd
+        and its resampling to fs. Last value of the freq vector is the Nyquist frequency.
+
+        Parameters
+        ----------
+        psd
+            PSD of the noise
         freq
             Frequency vector of the PSD
-        psd 
-            PSD of the noise
-        
+
         Returns
         ----------
-        time
-            Time vector of the signal
-        y
-            The generated time realisation
+        plan
+            Synthesis plan of the noise
         """
-        if np.isin(freq, 0)[0]:
-            freq=np.delete(freq, 0)
-            psd=np.delete(psd, 0)
-            
-        fs = freq[-1]*2
-            
-        n = len(freq)*2
-        w0 = np.zeros(1)
-
-        x = np.random.randn(len(freq)) + 1j*np.random.randn(len(freq))
-        w1 = np.sqrt(psd)/2*x
-        w = np.concatenate((w0, w1, np.conj(w1)[::-1])).astype(complex)
-        
-        y = np.sqrt(fs)*np.sqrt(n)*np.real(np.fft.ifft(w))
-        time = np.arange(0,n)*(1/fs)
-        
-        return time, y[1:]
+        new_freq = np.linspace(freq[0], freq[-1], int(self.noise_type.duration*freq[-1]), endpoint=True)
+        psd_i, freq_i = interpolate_(freq, new_freq, psd, fill_value='extrapolate')
+        if np.isin(freq_i, 0)[0]:
+            freq_i = np.delete(freq_i, 0)
+            psd_i = np.delete(psd_i, 0)
+
+        psd_fs = freq_i[-1]*2
+        n = len(freq_i)*2
+        time = np.arange(0, n)*(1/psd_fs)
+
+        # Output grid, truncated to the duration of the noise
+        new_time = np.linspace(0, (n*(self.fs/(freq[-1]*2)))/self.fs, int(n*(self.fs/(freq[-1]*2))))
+        new_time = new_time[:int(self.noise_type.duration*self.fs)]
+        hi_idx = np.clip(np.searchsorted(time, new_time), 1, n - 1)
+        lo_idx = hi_idx - 1
+        weight = (new_time - time[lo_idx])/(time[hi_idx] - time[lo_idx])
 
+        plan = SynthesisPlan(magnitude=np.sqrt(psd_i)/2, n_fft=n + 1, scale=np.sqrt(psd_fs)*np.sqrt(n),
+                             normalize=self.noise_type.name != 'model', lo_idx=lo_idx, weight=weight)
+        for arr in [plan.magnitude, plan.lo_idx, plan.weight]:
+            arr.flags.writeable = False
 
+        return plan
 
     def _model_psd(self) -> tuple[np.ndarray, np.ndarray]:
         """
@@ -311,8 +488,8 @@ class NoiseGenerator():
         """   
         if self.artifact_length*self.fs > len(arr):
             self.artifact_length = len(arr)/self.fs
-        # ma, bw = self._load_noise()
-        ma, bw = self.__artifact_arrs 
+        # the shared records of the registry, not copies held by this instance
+        ma, bw = self._load_noise()
         start = int(self.artifact_start*(len(arr)-(self.artifact_length*self.fs)))
         if self.artifact_type == 'ma':
             artifact = ma[int(self.artifact_idx*(len(ma)-(self.artifact_length*self.fs))):int(self.artifact_idx*(len(ma)-(self.artifact_length*self.fs)))+int(self.artifact_length*self.fs)]
@@ -333,7 +510,12 @@ class NoiseGenerator():
     
     def _load_noise(self):
         """
-        Downloads muscle artifact or baseline wander noise from MIT-BIH Noise Stress Test Database.
+        Loads muscle artifact or baseline wander noise from MIT-BIH Noise Stress Test Database, resampled to fs.
+        The records are read from nstdb_dir if given and otherwise downloaded from PhysioNet. 
+        If artifact_cache_dir is given, resampled records are stored there and read from there afterwards,
+        by default nothing is written to disk. The defaults of both are the NSTDB_DIR and NSTDB_CACHE_DIR
+        environment variables, so a populated cache or a local copy of the database works offline. 
+        The loaded records are shared by all NoiseGenerators of the process.
 
         Returns
         ----------
@@ -342,20 +524,49 @@ class NoiseGenerator():
         bw
             Baseline wander
         """   
-        # Load data
-        baseline_wander = rdsamp('bw', pn_dir='nstdb')
-        muscle_artifact = rdsamp('ma', pn_dir='nstdb')
+        ma, bw = [get_registered_noise(('artifact', record, int(self.fs), self.nstdb_dir, self.artifact_cache_dir),
+                                       lambda: self._load_nstdb_record(record)) for record in ['ma', 'bw']]
 
-        # Concatenate two channels to make one longer recording
-        ma = np.concatenate((muscle_artifact[0][:,0], muscle_artifact[0][:,1]))
-        bw = np.concatenate((baseline_wander[0][:,0], baseline_wander[0][:,1]))
+        return ma, bw
 
-        # Resample noise to wanted Hz
-        ma = resample_poly(ma, up=int(self.fs), down=muscle_artifact[1]['fs'])
-        bw = resample_poly(bw, up=int(self.fs), down=baseline_wander[1]['fs'])
+    def _load_nstdb_record(self, record: str) -> np.ndarray:
+        """
+        Returns one NSTDB record resampled to fs. Both channels are concatenated to make one longer recording.
 
-        return ma, bw
+        Parameters
+        ----------
+        record
+            Record name ('ma' or 'bw')
+
+        Returns
+        ----------
+        noise
+            Resampled record, memory-mapped from the cache if artifact_cache_dir is set
+        """
+        if self.artifact_cache_dir is not None:
+            cache_file = os.path.join(self.artifact_cache_dir, f'{record}_{int(self.fs)}hz.npy')
+            if os.path.exists(cache_file):
+                return np.load(cache_file, mmap_mode='r')
+
+        # Load data
+        if self.nstdb_dir is not None:
+            data = rdsamp(os.path.join(self.nstdb_dir, record))
+        else:
+            data = rdsamp(record, pn_dir='nstdb')
+
+        # Concatenate two channels and resample noise to wanted Hz
+        noise = np.concatenate((data[0][:,0], data[0][:,1]))
+        noise = resample_poly(noise, up=int(self.fs), down=data[1]['fs'])
+
+        if self.artifact_cache_dir is not None:
+            os.makedirs(self.artifact_cache_dir, exist_ok=True)
+            # Write to a temporary file first so that a concurrent reader never sees a partial file
+            tmp_file = f'{cache_file}.{os.getpid()}.tmp.npy'
+            np.save(tmp_file, noise)
+            os.replace(tmp_file, cache_file)
+            noise = np.load(cache_file, mmap_mode='r')
 
+        return noise
 
     def _concatenate_two_time_realisations(self, arr1: np.ndarray, arr2: np.ndarray, tap_len: int) -> tuple[np.ndarray, np.ndarray]:
         """
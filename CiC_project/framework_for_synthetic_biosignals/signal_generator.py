@@ -31,6 +31,34 @@ class SignalGenerator:
         beat_intervals
             Beat intervals multiplied with fs
 
+        """
+        der_raw, beat_intervals = self._derivative(beat_intervals, fs)
+
+        # Compute the final synthetic signal with numerical integration.
+        synt = integrate.cumtrapz(der_raw, dx=1/fs, initial=0)
+
+        # Normalize to range [0, 1].
+        synt = utils.min_max_normalize(synt)
+
+        return synt, beat_intervals
+
+    def _derivative(self, beat_intervals, fs) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Computes the derivative of the clean biosignal, i.e. the sum of the derivatives of the wave components.
+
+        Parameters
+        ----------
+        beat_intervals
+            Beat intervals for the signal
+        fs
+            Sampling frequency
+        Returns
+        ----------
+        der_raw
+            Derivative of the synthetic biosignal
+        beat_intervals
+            Beat intervals multiplied with fs
+
         """
         beat_intervals = np.array(beat_intervals * fs, dtype=int)
 
@@ -42,17 +70,15 @@ class SignalGenerator:
         n_dist = len(self.distance)
         s_len = np.sum(beat_intervals)
         ders = np.zeros((n_dist, s_len))
+
+        # Phase signals of all components.
+        phases = self._phase_signal(beat_intervals, pulse_widths_cumsum, np.asarray(self.distance, dtype=float))
         for i in range(n_dist):
             # Skip if the amplitude is zero.
             if self.amplitude[i] == 0:
                 continue
 
-            # Phase signal.
-            phase = np.zeros(s_len)
-            for j in range(1, pulse_widths_cumsum.size):
-                phase[pulse_widths_cumsum[j - 1]:pulse_widths_cumsum[j]] = \
-                    np.roll(np.linspace(-np.pi, np.pi, beat_intervals[j - 1]),
-                            int(self.distance[i]*beat_intervals[j - 1]))
+            phase = phases[i]
             # Derivative.
             neg_ind = np.where(phase<=0)
             pos_ind = np.where(phase>0)  
@@ -64,10 +90,38 @@ class SignalGenerator:
         # The final derivative of the signal is the sum of the derivatives.
         der_raw = np.sum(ders, axis=0)
 
-        # Compute the final synthetic signal with numerical integration.
-        synt = integrate.cumtrapz(der_raw, dx=1/fs, initial=0)
+        return der_raw, beat_intervals
 
-        # Normalize to range [0, 1].
-        synt = utils.min_max_normalize(synt)
+    def _phase_signal(self, beat_intervals: np.ndarray, pulse_widths_cumsum: np.ndarray, 
+                      distance: np.ndarray) -> np.ndarray:
+        """
+        Builds the phase signals of all wave components at once. Each beat is a linear
+        ramp from -pi to pi rolled by the distance of the component.
 
-        return synt, beat_intervals
+        Parameters
+        ----------
+        beat_intervals
+            Beat intervals in samples
+        pulse_widths_cumsum
+            Cumulative sum of beat intervals, starting from zero
+        distance
+            Distances of the wave components
+        Returns
+        ----------
+        phase
+            Phase signals, one row per wave component
+
+        """
+        beat_idx = np.repeat(np.arange(len(beat_intervals)), beat_intervals)
+        lengths = beat_intervals[beat_idx]
+        # Position of each sample inside its own beat.
+        pos = np.arange(len(beat_idx)) - pulse_widths_cumsum[beat_idx]
+        shifts = np.array(distance[:, np.newaxis]*beat_intervals, dtype=int)
+
+        # Same arithmetic as np.roll(np.linspace(-np.pi, np.pi, n), shift) per beat.
+        ramp_idx = (pos - shifts[:, beat_idx]) % np.maximum(lengths, 1)
+        step = 2*np.pi / np.maximum(lengths - 1, 1)
+        phase = ramp_idx*step - np.pi
+        phase[(ramp_idx == lengths - 1) & (lengths > 1)] = np.pi
+
+        return phase
@@ -0,0 +1,146 @@
+"""
+Benchmark of the wave derivative of SignalGenerator (framework_for_synthetic_biosignals/signal_generator.py).
+
+SignalGenerator._derivative builds the phase signals of all beats and wave components at once
+(_phase_signal). It is timed against loop_derivative, the loop over components and beats with
+np.linspace and np.roll it replaced, on the same random ECGGenerator beat intervals and wave
+parameters, and the outputs of both are checked to be equal. The results are written to a JSON
+file so that runs can be compared to find regressions.
+
+Example:
+    python generator_benchmark.py --signals 100 --beats 30 --fs 200 --seed 0
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import time
+
+import numpy as np
+
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+GENERATOR_DIR = os.path.join(PROJECT_DIR, 'framework_for_synthetic_biosignals')
+
+sys.path.insert(0, GENERATOR_DIR)
+from signal_generator import SignalGenerator
+
+
+def loop_phase_signal(beat_intervals, pulse_widths_cumsum, distance):
+    """
+    The phase signals of the original SignalGenerator.generate, one beat and component at a time.
+    """
+    phase = np.zeros((len(distance), np.sum(beat_intervals)))
+    for i in range(len(distance)):
+        for j in range(1, pulse_widths_cumsum.size):
+            phase[i, pulse_widths_cumsum[j - 1]:pulse_widths_cumsum[j]] = \
+                np.roll(np.linspace(-np.pi, np.pi, beat_intervals[j - 1]),
+                        int(distance[i]*beat_intervals[j - 1]))
+    return phase
+
+
+def loop_derivative(generator, beat_intervals, fs):
+    """
+    The derivative of the original SignalGenerator.generate, as returned by SignalGenerator._derivative.
+    """
+    beat_intervals = np.array(beat_intervals * fs, dtype=int)
+    pulse_widths_cumsum = np.zeros(len(beat_intervals) + 1, dtype=int)
+    pulse_widths_cumsum[1:] = np.cumsum(beat_intervals)
+
+    n_dist = len(generator.distance)
+    ders = np.zeros((n_dist, np.sum(beat_intervals)))
+    phases = loop_phase_signal(beat_intervals, pulse_widths_cumsum, generator.distance)
+    for i in range(n_dist):
+        if generator.amplitude[i] == 0:
+            continue
+        phase = phases[i]
+        neg_ind = np.where(phase<=0)
+        pos_ind = np.where(phase>0)
+        ders[i, neg_ind] = (-phase[neg_ind])  / (generator.width[i]**2) * generator.amplitude[i] * 2*np.pi* \
+            np.exp((- phase[neg_ind]**2) / (2 * generator.width[i] ** 2))
+        ders[i, pos_ind] = (-phase[pos_ind] * generator.symmetry[i])  / (generator.width[i]**2) * generator.amplitude[i]* 2*np.pi * \
+            np.exp((-generator.symmetry[i] * phase[pos_ind]**2) / (2 * generator.width[i] ** 2))
+
+    return np.sum(ders, axis=0), beat_intervals
+
+
+def random_signals(n, n_beats, seed=0):
+    """
+    Draws the beat intervals and wave parameters of n random ECGGenerator signals.
+
+    Returns
+    ----------
+    signals
+        List of (SignalGenerator, beat intervals in seconds).
+    """
+    # NoiseGenerator reads the measured PSDs relative to the working directory, already when
+    # ecg_generator is imported
+    cwd = os.getcwd()
+    os.chdir(GENERATOR_DIR)
+    try:
+        import ecg_generator as eg
+        ecg = eg.ECGGenerator()
+    finally:
+        os.chdir(cwd)
+
+    np.random.seed(seed)
+    random.seed(seed)
+    ecg.beat_interval_generator.n = n_beats
+    signals = []
+    for _ in range(n):
+        ecg._randomize()
+        generator = SignalGenerator(ecg.ecg_distance.to_list(), ecg.ecg_width.to_list(),
+                                    ecg.ecg_amplitude.to_list(), ecg.ecg_symmetry.to_list())
+        signals.append((generator, ecg.beat_interval_generator.generate()))
+    return signals
+
+
+def time_per_signal(derivative, signals, fs, repeats):
+    """
+    Returns the median over repeats of the mean time in ms of derivative(generator, beat_intervals, fs).
+    """
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for generator, beat_intervals in signals:
+            derivative(generator, beat_intervals, fs)
+        times.append((time.perf_counter() - start) / len(signals) * 1e3)
+    return float(np.median(times))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Speed of SignalGenerator._derivative against the loop it replaced.')
+    parser.add_argument('--signals', type=int, default=100, help='number of random signals')
+    parser.add_argument('--beats', type=int, default=30, help='beats of each signal')
+    parser.add_argument('--fs', type=int, default=200, help='sampling frequency')
+    parser.add_argument('--repeats', type=int, default=5, help='timed passes over all signals, the median is kept')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', help='output file, default: saved_data/generator_benchmark.json')
+    args = parser.parse_args(argv)
+
+    signals = random_signals(args.signals, args.beats, args.seed)
+    for generator, beat_intervals in signals:
+        der, samples = generator._derivative(beat_intervals, args.fs)
+        expected_der, expected_samples = loop_derivative(generator, beat_intervals, args.fs)
+        if not (np.array_equal(der, expected_der) and np.array_equal(samples, expected_samples)):
+            print('_derivative differs from loop_derivative')
+            return 1
+
+    results = {'loop_ms': time_per_signal(loop_derivative, signals, args.fs, args.repeats),
+               'vectorised_ms': time_per_signal(lambda generator, beat_intervals, fs: generator._derivative(beat_intervals, fs),
+                                                signals, args.fs, args.repeats)}
+    print('loop %8.3f ms/signal  vectorised %8.3f ms/signal  %.1fx' % (
+        results['loop_ms'], results['vectorised_ms'], results['loop_ms']/results['vectorised_ms']))
+
+    out = args.out or os.path.join(PROJECT_DIR, 'saved_data', 'generator_benchmark.json')
+    with open(out, 'w') as f:
+        json.dump({'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                   'python': platform.python_version(), 'numpy': np.__version__,
+                   'platform': platform.platform(), 'arguments': vars(args),
+                   'results': results}, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,210 @@
+"""
+Parallel, reproducible version of the sweeps in the 'tests' notebooks.
+
+For every value of the swept variable, signals_per_step synthetic ECG signals are generated
+and assessed with the 4 SQI tools (SQA1 Orphanidou, SQA2 Zhao & Zhang, SQA3 ECGAssess,
+SQA4 Elgendi). The result is the same 'Noise Type, SQA1..SQA4' table as in 'saved_data'.
+Each signal is generated from its own seed derived from (seed, step, signal), so a rerun
+with the same seed gives the same table regardless of the number of workers.
+
+The committed tables in 'saved_data' are read by the notebooks, so the output file has to be
+given and should not be one of them.
+
+The NSTDB artifact records are downloaded from PhysioNet unless the NSTDB_DIR (local copy of
+the database) or NSTDB_CACHE_DIR (resampled records, written on first use) environment
+variables are set, see NoiseGenerator._load_noise.
+
+Example:
+    python sweep.py HR --steps 100 --signals 100 --seed 0 --workers 8 --out HR_sweep.csv
+"""
+import argparse
+import os
+import random
+import sys
+from dataclasses import dataclass
+from multiprocessing import Pool
+
+import numpy as np
+import pandas as pd
+
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+GENERATOR_DIR = os.path.join(PROJECT_DIR, 'framework_for_synthetic_biosignals')
+ORPHANIDOU_DIR = os.path.join(PROJECT_DIR, 'Orphanidou ')
+TOOLBOX_DIR = os.path.join(PROJECT_DIR, 'Automated_ecg_assessment_og')
+ECGASSESS_DIR = os.path.join(PROJECT_DIR, 'ECGAssess_og')
+
+
+def _configure_hr(ecg, value, beats):
+    ecg.number_of_beats = int(value/4)
+    ecg.beat_interval_generator.mu = 60/value
+
+def _configure_ma(ecg, value, beats):
+    ecg.beat_interval_generator.beat_intervals = beats
+    ecg.noise_generator.artifact_bool = True
+    ecg.noise_generator.noise_type.name = value
+
+def _configure_wn(ecg, value, beats):
+    ecg.beat_interval_generator.beat_intervals = beats
+    ecg.noise_generator.noise_type.wn = value
+
+def _configure_pv(ecg, value, beats):
+    ecg.beat_interval_generator.beat_intervals = beats
+    ecg.noise_generator.noise_type.point_bool = True
+    ecg.noise_generator.noise_type.point_freq = 0.5
+    ecg.noise_generator.noise_type.point_value = value
+
+
+@dataclass
+class Sweep:
+    """Swept variable: how it is set on the ECGGenerator and its default range."""
+    configure: object
+    start: float = 0
+    increment: float = 1
+    values: list = None
+
+SWEEPS = {
+    'HR': Sweep(_configure_hr, start=5, increment=10),
+    'MA': Sweep(_configure_ma, values=['walking', 'hand_movement', 'muscle_artifact', 'baseline_wander']),
+    'WN': Sweep(_configure_wn, start=0, increment=2),
+    'PV': Sweep(_configure_pv, start=0, increment=5),
+}
+
+
+def sweep_values(name, start=None, increment=None, steps=100):
+    """
+    Returns the values of the swept variable: the fixed list of the sweep, or start + i*increment for i < steps.
+    """
+    sweep = SWEEPS[name]
+    if sweep.values is not None:
+        return list(sweep.values)
+    start = sweep.start if start is None else start
+    increment = sweep.increment if increment is None else increment
+    return [start + i*increment for i in range(steps)]
+
+
+def task_seed(seed, step, signal_nr):
+    """
+    Seed of one signal, independent of the order in which the tasks are run.
+    """
+    return int(np.random.SeedSequence([seed, step, signal_nr]).generate_state(1)[0])
+
+
+# SQI tools and generator, imported once per worker process
+_tools = {}
+
+def _init_worker(model_path, model_name):
+    # in front of site-packages, so that ecgdetectors is the toolbox copy and not an installed py-ecg-detectors
+    for path in reversed([GENERATOR_DIR, ORPHANIDOU_DIR, TOOLBOX_DIR, os.path.join(TOOLBOX_DIR, 'toolbox'), ECGASSESS_DIR]):
+        if path in sys.path:
+            sys.path.remove(path)
+        sys.path.insert(0, path)
+    # NoiseGenerator reads the measured PSDs relative to the working directory
+    os.chdir(GENERATOR_DIR)
+
+    import ecg_generator as eg
+    import neurokit2 as nk
+    from orphanidou import OrphanidouSQI
+    from toolbox.AlgorithmsV5_k_model import processing
+    from Code.AlgorithmsV5 import processing1
+
+    _tools.update(eg=eg, nk=nk, orphanidou=OrphanidouSQI(fs=200, thresh=0.66), processing=processing, processing1=processing1,
+                  beats=np.load(os.path.join(GENERATOR_DIR, 'beats_array.npy')),
+                  model_path=model_path, model_name=model_name)
+
+
+def assess_signal(signal):
+    """
+    Runs a 200 Hz signal through the 4 SQI tools as in the notebooks. Returns 1 for acceptable and 0 otherwise.
+    """
+    nk = _tools['nk']
+
+    quality_o = _tools['orphanidou'].assess(signal).quality
+
+    # if the code breaks due to not detecting HR then record as 'Unacceptable'
+    try:
+        quality_z = nk.ecg_quality(signal, sampling_rate=200, method="zhao2018")
+    except Exception:
+        quality_z = 'Unacceptable'
+
+    # the final 2 SQIs take 500 Hz data with the sample index as the first row
+    resampled_signal = nk.signal_resample(signal, sampling_rate=200, desired_sampling_rate=500, method="numpy")
+    reshaped_array = np.vstack((np.arange(5000), resampled_signal))
+
+    quality_e = _tools['processing1'](reshaped_array, total_leads=1, temp_freq=500)
+    quality_a = _tools['processing'](reshaped_array, num_leads=1, temp_freq=500, SNR_threshold=0.5, signal_freq_band=[2, 40],
+                                     window_length=100, heart_rate_limits=[25, 300], max_loss_passband=0.1,
+                                     min_loss_stopband=20, sampling_frequency=500,
+                                     path_model=_tools['model_path'], name_model=_tools['model_name'])
+
+    return (0 if quality_o == 0 else 1,
+            0 if quality_z == 'Unacceptable' else 1,
+            0 if quality_e[3][0] == u"\u2716" else 1,
+            0 if quality_a[4][0] == u"\u2716" else 1)
+
+
+def _run_task(task):
+    name, value, seed = task
+    np.random.seed(seed)
+    random.seed(seed)
+
+    ecg = _tools['eg'].ECGGenerator()
+    SWEEPS[name].configure(ecg, value, _tools['beats'])
+    signal, peaks, labels, beats = ecg.generate()
+
+    return assess_signal(signal[0:2000])
+
+
+def run_sweep(name, values, signals_per_step=100, seed=0, workers=None,
+              model_path=os.path.join(TOOLBOX_DIR, 'cnn_lstm'), model_name='saved_model'):
+    """
+    Runs the sweep over a process pool.
+
+    Returns
+    ----------
+    df
+        DataFrame with columns 'Noise Type', 'SQA1', 'SQA2', 'SQA3', 'SQA4': the chance of each SQI
+        returning an acceptable result at each value.
+    """
+    tasks = [(name, value, task_seed(seed, step, signal_nr))
+             for step, value in enumerate(values) for signal_nr in range(signals_per_step)]
+
+    with Pool(workers, initializer=_init_worker, initargs=(model_path, model_name)) as pool:
+        # map keeps the order of the tasks, so the table does not depend on scheduling
+        results = pool.map(_run_task, tasks, chunksize=max(1, signals_per_step // 4))
+    results = np.array(results).reshape(len(values), signals_per_step, 4)
+
+    # the MA sweep is indexed by noise type, the others by step
+    index = values if SWEEPS[name].values is not None else range(len(values))
+    df = pd.DataFrame({'Noise Type': [str(value) for value in values]}, index=index)
+    for sqa in range(4):
+        df['SQA' + str(sqa + 1)] = np.mean(results[:, :, sqa], axis=1)
+
+    return df
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Parallel SQI sweep over synthetic ECG signals.')
+    parser.add_argument('sweep', choices=sorted(SWEEPS), help='variable that is changed')
+    parser.add_argument('--start', type=float, help='first value of the variable')
+    parser.add_argument('--increment', type=float, help='increment of the variable')
+    parser.add_argument('--steps', type=int, default=100, help='number of values')
+    parser.add_argument('--signals', type=int, default=100, help='signals per value')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=None, help='number of processes, default: all cores')
+    parser.add_argument('--model-path', default=os.path.join(TOOLBOX_DIR, 'cnn_lstm'))
+    parser.add_argument('--model-name', default='saved_model')
+    parser.add_argument('--out', required=True, help="output file (not one of the saved_data/*_final tables)")
+    args = parser.parse_args(argv)
+
+    values = sweep_values(args.sweep, args.start, args.increment, args.steps)
+    # keep integer values integer so that the 'Noise Type' column matches the notebooks
+    values = [int(v) if isinstance(v, float) and v.is_integer() else v for v in values]
+
+    df = run_sweep(args.sweep, values, args.signals, args.seed, args.workers,
+                   os.path.abspath(args.model_path), args.model_name)
+
+    df.to_csv(args.out)
+
+
+if __name__ == '__main__':
+    main()
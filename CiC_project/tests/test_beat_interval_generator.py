@@ -0,0 +1,83 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(PROJECT_DIR, 'framework_for_synthetic_biosignals'))
+from beat_interval_generator import BeatIntervalGenerator
+
+
+def loop_stochastic(generator, n, a, std, b):
+    """
+    The original loop of BeatIntervalGenerator._stochastic().
+    """
+    k, x = generator._rand_sequence(n, a, std)
+    y, y_tmp = np.zeros(n), np.zeros(n)
+    for i in np.arange(n):
+        if i - k[i] > 0:
+            avg = np.mean(np.square(y_tmp[i-k[i]:i]))
+            y_tmp[i] = x[i]*np.sqrt(1+b*avg)
+        else:
+            y_tmp[i] = 0
+
+        m = np.zeros(i)
+        m[(k[:i] + np.arange(i) - i) > 0] = 1
+        y[i] = 0.05*np.sum(y_tmp[:i]*m)
+    return y
+
+
+@pytest.mark.parametrize('n', [1, 30, 100, 500])
+def test_stochastic_equals_loop(n):
+    generator = BeatIntervalGenerator()
+    for seed in range(20):
+        np.random.seed(seed)
+        expected = loop_stochastic(generator, n, generator.a, generator.std, generator.b)
+        np.random.seed(seed)
+        y = generator._stochastic(n, generator.a, generator.std, generator.b)
+        np.testing.assert_allclose(y, expected, rtol=1e-12, atol=1e-12)
+
+
+def test_stochastic_long_spans(monkeypatch):
+    generator = BeatIntervalGenerator()
+    sequence = generator._rand_sequence
+
+    def long_spans(n, a, std):
+        k, x = sequence(n, a, std)
+        k[::7] = 10**15
+        return k, x
+
+    monkeypatch.setattr(generator, '_rand_sequence', long_spans)
+    np.random.seed(0)
+    expected = loop_stochastic(generator, 100, generator.a, generator.std, generator.b)
+    state = generator._new_state()
+    np.random.seed(0)
+    y = generator._stochastic(100, generator.a, generator.std, generator.b, state)
+    np.testing.assert_allclose(y, expected, rtol=1e-12, atol=1e-12)
+    # only the spans reaching past the block are carried
+    assert len(state['span_ends']) <= 100
+
+
+def test_stochastic_history_is_bounded(monkeypatch):
+    generator = BeatIntervalGenerator(history=50)
+    reference = BeatIntervalGenerator(history=10**9)
+    for g in [generator, reference]:
+        sequence = g._rand_sequence
+
+        def short_spans(n, a, std, sequence=sequence):
+            k, x = sequence(n, a, std)
+            return np.minimum(k, 50), x
+
+        monkeypatch.setattr(g, '_rand_sequence', short_spans)
+
+    state, reference_state = generator._new_state(), reference._new_state()
+    for block in range(200):
+        np.random.seed(block)
+        y = generator._stochastic(30, generator.a, generator.std, generator.b, state)
+        np.random.seed(block)
+        expected = reference._stochastic(30, reference.a, reference.std, reference.b, reference_state)
+        # no window reaches back more than history beats, so the result is the same
+        np.testing.assert_allclose(y, expected, rtol=1e-12, atol=1e-12)
+        assert len(state['sq_cumsum']) <= 2*(generator.history + 1) + 30
+    assert len(reference_state['sq_cumsum']) > 200*30
@@ -0,0 +1,75 @@
+import json
+import os
+import sys
+
+import numpy as np
+import pytest
+import scipy.signal as signal
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_DIR)
+sys.path.insert(0, os.path.join(PROJECT_DIR, 'Automated_ecg_assessment_og', 'toolbox'))
+import detector_benchmark
+from ecgdetectors import Detectors, MWA_convolve, _wqrs_length_transform
+
+STORED_PEAKS = os.path.join(PROJECT_DIR, 'saved_data', 'detector_peaks_set_a.json')
+
+
+def loop_length_transform(x, w, fs):
+    """
+    The original loop of the WQRS length transform.
+    """
+    tmp = []
+    for i in range(w, len(x)):
+        curr = 0
+        for k in range(i-w+1, i):
+            curr += np.sqrt(np.power(1/fs, 2)+np.power(x[i]-x[i-1], 2))
+        tmp.append(curr)
+    l = [tmp[0]]*w
+    return l+tmp
+
+
+def loop_wqrs(unfiltered_ecg, fs):
+    """
+    The original wqrs_detector, with the original threshold loop.
+    """
+    b, a = signal.butter(2, 15/(0.5*fs), btype='low', analog=False)
+    x = loop_length_transform(signal.lfilter(b, a, unfiltered_ecg), int(np.ceil(fs*0.13)), fs)
+    peaks = []
+    u = MWA_convolve(x, 10*fs)
+    for i in range(len(x)):
+        if (len(peaks) == 0 or i > peaks[-1]+(fs*0.35)) and x[i] > u[i]:
+            peaks.append(i)
+    return peaks
+
+
+@pytest.mark.parametrize('fs', [250, 500])
+def test_length_transform_equals_loop(fs):
+    w = int(np.ceil(fs*0.13))
+    x = np.cumsum(np.random.default_rng(fs).standard_normal((2, 1200)), axis=-1)
+    y = _wqrs_length_transform(x, w, fs)
+    for lead, transformed in zip(x, y):
+        np.testing.assert_array_equal(transformed, loop_length_transform(lead, w, fs))
+
+
+def test_wqrs_equals_loop():
+    # the threshold compares the constant first samples of the transform with their own average,
+    # how these ties resolve depends on the library versions, so the loop runs in the same environment
+    leads = detector_benchmark.load_set_a(1)[:3] + [np.zeros(5000)]
+    detectors = Detectors(500)
+    for lead in leads:
+        assert detectors.wqrs_detector(lead) == loop_wqrs(lead, 500)
+
+
+def test_stored_peaks():
+    # the peaks of the detectors in ecgdetectors.py at the baseline commit, see the commit message
+    with open(STORED_PEAKS) as f:
+        stored = json.load(f)
+    leads = detector_benchmark.load_set_a(stored['records'])
+    if not leads:
+        pytest.skip('set-a recordings not found')
+    # WQRS depends on the library versions, it is compared with its loop in test_wqrs_equals_loop
+    detectors = [description for description in stored['peaks'] if description != 'WQRS']
+    peaks = detector_benchmark.detector_peaks(leads, stored['fs'], detectors)
+    assert peaks.keys() == set(detectors)
+    assert detector_benchmark.compare_peaks(stored['peaks'], peaks) == {}
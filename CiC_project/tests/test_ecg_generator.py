@@ -0,0 +1,151 @@
+import os
+import random
+import sys
+
+import numpy as np
+import pytest
+from scipy import integrate
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+GENERATOR_DIR = os.path.join(PROJECT_DIR, 'framework_for_synthetic_biosignals')
+sys.path.insert(0, GENERATOR_DIR)
+
+# NoiseGenerator reads the measured PSDs relative to the working directory, already when
+# ecg_generator is imported
+cwd = os.getcwd()
+os.chdir(GENERATOR_DIR)
+try:
+    from ecg_generator import ECGGenerator
+    from noise_generator import NoiseType
+finally:
+    os.chdir(cwd)
+
+
+def ecg_generator(**kwargs):
+    ecg = ECGGenerator(**kwargs)
+    # the artifacts are NSTDB records, downloaded from PhysioNet
+    ecg.noise_generator.artifact_prob = 0
+    return ecg
+
+
+def assert_batches_equal(batch, expected):
+    signals, peak_labels, labels, beat_intervals, beat_offsets, lengths = batch
+    np.testing.assert_array_equal(signals, expected[0])
+    np.testing.assert_array_equal(peak_labels, expected[1])
+    for label, expected_label in zip(labels, expected[2]):
+        assert [noise for noise, _ in label] == [noise for noise, _ in expected_label]
+        for (_, values), (_, expected_values) in zip(label, expected_label):
+            np.testing.assert_array_equal(values, expected_values)
+    np.testing.assert_array_equal(beat_intervals, expected[3])
+    np.testing.assert_array_equal(beat_offsets, expected[4])
+    np.testing.assert_array_equal(lengths, expected[5])
+
+
+def test_batch_seed_is_reproducible_and_restores_state():
+    np.random.seed(1)
+    random.seed(1)
+    np_state, random_state = np.random.get_state(), random.getstate()
+    batch = ecg_generator().generate_batch(4, 10, seed=7)
+
+    # the global generators continue as if the batch had not been generated
+    assert random.getstate() == random_state
+    restored = np.random.get_state()
+    assert restored[0] == np_state[0]
+    np.testing.assert_array_equal(restored[1], np_state[1])
+    assert restored[2:] == np_state[2:]
+
+    # the same seed gives the same batch, from any global state and generator
+    np.random.seed(2)
+    random.seed(2)
+    assert_batches_equal(ecg_generator().generate_batch(4, 10, seed=7), batch)
+
+    signals, peak_labels, labels, beat_intervals, beat_offsets, lengths = batch
+    assert signals.shape == peak_labels.shape == (4, 2000)
+    assert signals.dtype == peak_labels.dtype == np.float32
+    assert not np.isnan(signals).any()
+    np.testing.assert_array_equal(lengths, 2000)
+    assert beat_offsets[0] == 0 and beat_offsets[-1] == len(beat_intervals)
+    assert not np.array_equal(signals[0], signals[1])
+
+
+def test_batch_rows_are_padded_with_nan():
+    # with a noise_list, the signals end with its 5 s, the rows hold 10 s
+    ecg = ecg_generator()
+    ecg.noise_generator.noise_list = [NoiseType('walking', duration=3), NoiseType('model', duration=2)]
+    signals, peak_labels, labels, _, _, lengths = ecg.generate_batch(3, 10, seed=1)
+
+    assert signals.shape == (3, 2000)
+    assert np.all((lengths > 900) & (lengths <= 1000))
+    for signal, peak_label, label, length in zip(signals, peak_labels, labels, lengths):
+        assert not np.isnan(signal[:length]).any()
+        assert np.isnan(signal[length:]).all()
+        assert np.any(peak_label[:length] == np.float32(0.6))
+        assert not peak_label[length:].any()
+        # the noise labels cover the samples of the signal, one segment per noise type, the artifact label all
+        assert sum(len(values) for _, values in label[:-1]) == len(label[-1][1]) == length
+    # the durations of the noise_list are kept
+    assert [noise_type.duration for noise_type in ecg.noise_generator.noise_list] == [3, 2]
+
+
+def stream(ecg, chunk_size, n_chunks, seed):
+    np.random.seed(seed)
+    random.seed(seed)
+    chunks = list(ecg.generate_stream(chunk_size, n_chunks))
+    assert all(len(part) == chunk_size for chunk in chunks for part in chunk)
+    return [np.concatenate(parts) for parts in zip(*chunks)]
+
+
+@pytest.mark.parametrize('seed', [0, 1, 2])
+def test_stream_equals_generate(seed):
+    ecg = ecg_generator()
+    ecg.noise_generator = None
+    np.random.seed(seed)
+    random.seed(seed)
+    signal, peak_labels, _, _ = ecg.generate()
+
+    # the first block of beats of the stream is the signal of generate(), normalized alike
+    chunk_size = 250
+    n_chunks = len(signal) // chunk_size
+    streamed_signal, streamed_peak_labels, noise_labels, artifact_labels = stream(ecg, chunk_size, n_chunks, seed)
+    np.testing.assert_array_equal(streamed_signal, signal[:n_chunks*chunk_size])
+    np.testing.assert_array_equal(streamed_peak_labels, peak_labels[:n_chunks*chunk_size])
+    assert not noise_labels.any() and not artifact_labels.any()
+
+
+def test_stream_does_not_depend_on_chunk_size():
+    # over many blocks of beats, the integration continues over the chunk boundaries
+    ecg = ecg_generator()
+    ecg.noise_generator = None
+    ecg.number_of_beats = 5
+    expected = stream(ecg, 3000, 4, seed=3)
+    for chunk_size, n_chunks in [(1000, 12), (7, 1714), (12000, 1)]:
+        for part, expected_part in zip(stream(ecg, chunk_size, n_chunks, seed=3), expected):
+            np.testing.assert_array_equal(part, expected_part[:chunk_size*n_chunks])
+
+
+def test_stream_with_noise():
+    ecg = ecg_generator()
+    ecg.noise_generator.noise_type = NoiseType('model', duration=4)
+    signal, peak_labels, noise_labels, artifact_labels = stream(ecg, 1000, 10, seed=4)
+    assert not np.isnan(signal).any()
+    # the noise segments of 4 s are joined without gaps in the labels
+    np.testing.assert_array_equal(noise_labels, ecg.noise_generator.noise_type.amplitude)
+    assert np.count_nonzero(peak_labels == 0.6) > 0
+
+
+def test_stream_continues_over_blocks():
+    # with fixed beat intervals every block is the same, the stream is one integration over all of them
+    ecg = ecg_generator()
+    ecg.noise_generator = None
+    beat_intervals = np.array([0.8, 0.75, 0.9, 0.7, 0.85])
+    ecg.beat_interval_generator.beat_intervals = beat_intervals
+    signal, peak_labels, _, _ = stream(ecg, 400, 20, seed=5)
+
+    der, samples = ecg._derivative(beat_intervals, ecg.fs)
+    n_blocks = -(-len(signal) // len(der))
+    synt = integrate.cumtrapz(np.tile(der, n_blocks), dx=1/ecg.fs, initial=0)
+    # normalized with the range of the first block
+    first = synt[:len(der)]
+    expected = (synt - first.min()) / (first.max() - first.min())
+    np.testing.assert_allclose(signal, expected[:len(signal)], rtol=0, atol=1e-9)
+    np.testing.assert_array_equal(peak_labels, np.tile(ecg._peak_labels(samples, len(der)), n_blocks)[:len(signal)])
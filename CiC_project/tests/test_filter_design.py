@@ -0,0 +1,91 @@
+import importlib
+import os
+import sys
+
+import numpy as np
+import pytest
+import scipy.signal as signal
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_DIR)
+sys.path.insert(0, os.path.join(PROJECT_DIR, 'Automated_ecg_assessment_og', 'toolbox'))
+import detector_benchmark
+import ecgdetectors
+from ecgdetectors import Detectors, _butter_coefficients
+
+
+def designs(fs):
+    """
+    The (order, Wn, btype) of every filter the detectors design at fs.
+    """
+    return [(1, (8/fs*2, 16/fs*2), 'bandpass'),     # hamilton
+            (4, (0.1/fs*2, 48/fs*2), 'bandpass'),   # matched filter
+            (4, (48/fs*2, 52/fs*2), 'bandstop'),    # engzee
+            (1, (5/fs*2, 15/fs*2), 'bandpass'),     # pan tompkins
+            (2, (8/fs*2, 20/fs*2), 'bandpass'),     # two average
+            (2, 15/(0.5*fs), 'low')]                # wqrs
+
+
+def direct_butter(order, Wn, btype):
+    """
+    The previous path, a new design on every call.
+    """
+    return signal.butter(order, list(Wn) if np.ndim(Wn) else Wn, btype=btype)
+
+
+@pytest.mark.parametrize('fs', [250, 360, 500])
+def test_memoised_coefficients_equal_butter(fs):
+    x = np.random.default_rng(fs).standard_normal((2, 2000))
+    for design in designs(fs):
+        b, a = _butter_coefficients(*design)
+        expected_b, expected_a = direct_butter(*design)
+        np.testing.assert_array_equal(b, expected_b)
+        np.testing.assert_array_equal(a, expected_a)
+        np.testing.assert_array_equal(signal.lfilter(b, a, x, axis=-1), signal.lfilter(expected_b, expected_a, x, axis=-1))
+        assert not b.flags.writeable and not a.flags.writeable
+        assert _butter_coefficients(*design)[0] is b
+
+
+def detections(method, lead):
+    try:
+        return list(method(lead))
+    except IndexError as error:
+        # engzee on leads without detections, in both paths
+        return type(error).__name__
+
+
+def test_detectors_equal_direct_design(monkeypatch, tmp_path):
+    leads = detector_benchmark.load_set_a(1)[:3]
+    if not leads:
+        pytest.skip('set-a recordings not found')
+    # the templates of the matched filter are not in the repository, a 40 ms mexican hat stands in
+    t = np.linspace(-2.5, 2.5, 20)
+    template_file = tmp_path/'template.csv'
+    np.savetxt(template_file, (1 - t**2)*np.exp(-t**2/2))
+    detectors = Detectors(500)
+    methods = [detectors.hamilton_detector, detectors.engzee_detector, detectors.pan_tompkins_detector,
+               detectors.two_average_detector, detectors.wqrs_detector,
+               lambda lead: detectors.matched_filter_detector(lead, str(template_file))]
+    memoised = [[detections(method, lead) for lead in leads] for method in methods]
+    monkeypatch.setattr(ecgdetectors, '_butter_coefficients', direct_butter)
+    assert memoised == [[detections(method, lead) for lead in leads] for method in methods]
+
+
+@pytest.mark.parametrize('module, directory', [('AlgorithmsV5', os.path.join('ECGAssess_og', 'Code')),
+                                               ('AlgorithmsV5_k_model', os.path.join('Automated_ecg_assessment_og', 'toolbox'))])
+def test_buttord_coefficients_equal_buttord(module, directory):
+    sys.path.insert(0, os.path.join(PROJECT_DIR, directory))
+    try:
+        algorithms = importlib.import_module(module)
+    except ImportError as error:
+        pytest.skip(f'{module} needs {error.name}')
+    finally:
+        sys.path.pop(0)
+    x = np.random.default_rng(0).standard_normal((2, 5000))
+    for wp, ws in [(20, 30), (0.5, 8)]:
+        b, a = algorithms._buttord_coefficients(wp, ws, 0.1, 20, 500)
+        order, normal_cutoff = signal.buttord(wp, ws, 0.1, 20, fs=500)
+        expected_b, expected_a = signal.butter(order, normal_cutoff, fs=500)
+        np.testing.assert_array_equal(b, expected_b)
+        np.testing.assert_array_equal(a, expected_a)
+        np.testing.assert_array_equal(signal.filtfilt(b, a, x), signal.filtfilt(expected_b, expected_a, x))
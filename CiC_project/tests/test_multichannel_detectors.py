@@ -0,0 +1,38 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(PROJECT_DIR, 'Automated_ecg_assessment_og', 'toolbox'))
+from ecgdetectors import Detectors
+
+SET_A_DIR = os.path.join(PROJECT_DIR, 'ECGAssess_og', 'set-a')
+FS = 500
+
+
+def per_lead(detector, lead):
+    try:
+        return [int(peak) for peak in detector(lead)]
+    except IndexError:
+        # Christov and Engzee on a lead without any detection
+        return []
+
+
+# Matched filter has no template for 500 Hz
+@pytest.mark.parametrize('name', ['two_average', 'swt', 'engzee', 'christov', 'hamilton', 'pan_tompkins', 'wqrs'])
+def test_2d_with_flat_lead_equals_per_lead(name):
+    record = os.path.join(SET_A_DIR, '1004502.txt')
+    if not os.path.exists(record):
+        pytest.skip('set-a recordings not found')
+    # the first column is the sample number
+    leads = np.loadtxt(record, delimiter=',').T[1:5]
+    leads = np.vstack((leads[:2], np.zeros(leads.shape[1]), leads[2:]))
+    detector = getattr(Detectors(FS), name+'_detector')
+
+    peaks = detector(leads)
+    assert len(peaks) == len(leads)
+    assert [[int(peak) for peak in channel] for channel in peaks] == [per_lead(detector, lead) for lead in leads]
+    # the other leads keep their peaks
+    assert all(len(peaks[i]) > 0 for i in (0, 1, 3, 4))
@@ -0,0 +1,24 @@
+import os
+import sys
+import warnings
+
+import numpy as np
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(PROJECT_DIR, 'Automated_ecg_assessment_og', 'toolbox'))
+sys.path.insert(0, os.path.join(PROJECT_DIR, 'Orphanidou '))
+import orphanidou
+from orphanidou import OrphanidouSQI
+
+
+def test_no_complete_beat_windows(monkeypatch):
+    # a feasible HR of 60 bpm, but the window of the first beat starts before the signal
+    monkeypatch.setattr(orphanidou, 'detect_beats', lambda sig, fs, detectors: [40, 240])
+    x = np.random.default_rng(0).standard_normal(2000)
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        result = OrphanidouSQI(fs=200).assess(x)
+    assert result.quality == 0
+    assert result.reasons == ('No complete beat windows',)
+    assert result.cc is None
+    assert result.beats == (40, 240)
@@ -0,0 +1,47 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_DIR)
+from generator_benchmark import loop_derivative, loop_phase_signal, random_signals
+from signal_generator import SignalGenerator
+
+
+def random_generator(rng, n_beats, fs):
+    distance = rng.uniform(-0.3, 0.3, 5)
+    width = rng.uniform(0.03, 0.2, 5)
+    # some components are skipped
+    amplitude = rng.uniform(-0.2, 1.2, 5) * (rng.random(5) > 0.2)
+    symmetry = rng.uniform(1, 5, 5)
+    # down to beats of 0, 1 and 2 samples
+    beat_intervals = rng.uniform(0, 1.5, n_beats) if rng.random() > 0.3 else rng.integers(0, 3, n_beats) / fs
+    return SignalGenerator(distance.tolist(), width.tolist(), amplitude.tolist(), symmetry.tolist()), beat_intervals
+
+
+@pytest.mark.parametrize('fs', [100, 200, 360, 500])
+def test_phase_signal_and_derivative_equal_loop(fs):
+    rng = np.random.default_rng(fs)
+    for n_beats in [1, 2, 7, 30, 60]:
+        for _ in range(10):
+            generator, beat_intervals = random_generator(rng, n_beats, fs)
+            samples = np.array(beat_intervals * fs, dtype=int)
+            cumsum = np.concatenate(([0], np.cumsum(samples)))
+            distance = np.asarray(generator.distance, dtype=float)
+            np.testing.assert_array_equal(generator._phase_signal(samples, cumsum, distance),
+                                          loop_phase_signal(samples, cumsum, distance))
+
+            der, der_samples = generator._derivative(beat_intervals, fs)
+            expected_der, expected_samples = loop_derivative(generator, beat_intervals, fs)
+            np.testing.assert_array_equal(der, expected_der)
+            np.testing.assert_array_equal(der_samples, expected_samples)
+
+
+def test_derivative_equals_loop_on_ecg_parameters():
+    for generator, beat_intervals in random_signals(20, 30, seed=0):
+        der, samples = generator._derivative(beat_intervals, 200)
+        expected_der, expected_samples = loop_derivative(generator, beat_intervals, 200)
+        np.testing.assert_array_equal(der, expected_der)
+        np.testing.assert_array_equal(samples, expected_samples)
@@ -0,0 +1,48 @@
+import glob
+import os
+import sys
+
+import numpy as np
+import pytest
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(PROJECT_DIR, 'Automated_ecg_assessment_og', 'toolbox'))
+from ecgdetectors import ChristovStream, Detectors, EngzeeStream, StreamingDetector
+
+SET_A_DIR = os.path.join(PROJECT_DIR, 'ECGAssess_og', 'set-a')
+FS = 500
+
+
+def set_a_leads(n_records):
+    leads = []
+    for file in sorted(glob.glob(os.path.join(SET_A_DIR, '*.txt')))[:n_records]:
+        # the first column is the sample number
+        leads.extend(np.loadtxt(file, delimiter=',').T[1:])
+    return leads
+
+
+@pytest.mark.parametrize('stream', [lambda: StreamingDetector(FS, 'pan_tompkins'),
+                                    lambda: StreamingDetector(FS, 'hamilton'),
+                                    lambda: StreamingDetector(FS, 'two_average'),
+                                    lambda: ChristovStream(FS),
+                                    lambda: EngzeeStream(FS)])
+def test_empty_chunk(stream):
+    detector = stream()
+    assert detector.push(np.zeros(0)) == []
+    assert detector.push([]) == []
+
+
+@pytest.mark.parametrize('detector', ['pan_tompkins', 'hamilton', 'two_average'])
+def test_stream_equals_batch(detector):
+    leads = set_a_leads(2)
+    if not leads:
+        pytest.skip('set-a recordings not found')
+    batch = getattr(Detectors(FS), detector+'_detector')
+    for lead in leads:
+        stream = StreamingDetector(FS, detector)
+        beats = []
+        for start in range(0, len(lead), 137):
+            beats += stream.push(lead[start:start+137])
+            # empty chunks between the samples do not change the state
+            beats += stream.push(lead[:0])
+        assert sorted(map(int, beats)) == sorted(map(int, batch(lead)))
@@ -0,0 +1,35 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(PROJECT_DIR, 'Automated_ecg_assessment_og', 'toolbox'))
+from ecgdetectors import Detectors, _swt_detail, _swt_plan
+
+pywt = pytest.importorskip('pywt')
+
+
+# 5000 needs no padding, 4997 and 1001 are padded to a multiple of 2**3
+@pytest.mark.parametrize('n_samples', [5000, 4997, 1001])
+def test_swt_detail_equals_pywt(n_samples):
+    padding, steps = _swt_plan(n_samples, 3)
+    assert (n_samples + padding) % 2**3 == 0
+    assert padding < 2**3
+
+    rng = np.random.default_rng(n_samples)
+    x = np.pad(rng.standard_normal((3, n_samples)), [(0, 0), (0, padding)], 'edge')
+    expected = pywt.swt(x, 'db3', level=3, axis=-1)[0][1]
+    np.testing.assert_allclose(_swt_detail(x, steps), expected, rtol=0, atol=1e-12)
+    # one lead at a time
+    np.testing.assert_allclose(_swt_detail(x[0], steps), expected[0], rtol=0, atol=1e-12)
+
+
+def test_swt_detector_runs_on_leads():
+    rng = np.random.default_rng(0)
+    leads = rng.standard_normal((2, 4997))
+    detectors = Detectors(500)
+    batch = detectors.swt_detector(leads)
+    assert len(batch) == 2
+    assert [list(peaks) for peaks in batch] == [list(detectors.swt_detector(lead)) for lead in leads]